@@ -0,0 +1,185 @@
+"""
+ChunkIndex - compact on-disk summary of every chunk of a world, for filtering chunks
+without decompressing and decoding them.
+
+One fixed-size record per chunk: global chunk coordinates, sector offset and count in
+its region file, compression version, timestamp, InhabitedTime, LastUpdate, number of
+entities and tile entities and DataVersion (-1 - value not present in the chunk).
+Only the summarised tags are decoded, see nbt_lib.extract.
+
+The index is kept per region file together with its mtime and size; update() re-reads
+only region files modified since, and only chunks whose timestamp or size changed.
+"""
+import os
+from collections import namedtuple
+from struct import Struct
+import nbt_lib as nbt
+import region_file
+
+index_name = "###Python_Chunk_Index.idx"
+index_magic = b"PNCI"
+index_version = 1
+header_struct = Struct(">4sHI")  # magic, wersja, liczba regionów
+region_struct = Struct(">iiqqI")  # rx, rz, mtime_ns, rozmiar pliku, liczba rekordów
+record_struct = Struct(">iiIBBIqqiii")
+
+# Pre-1.18 chunks keep their data in the "Level" compound, newer ones in the root
+_summary_paths = ("DataVersion", "Level.InhabitedTime", "Level.LastUpdate", "Level.Entities", "Level.TileEntities",
+                  "InhabitedTime", "LastUpdate", "entities", "block_entities")
+
+
+class ChunkRecord(namedtuple("ChunkRecord", "x z sector sectors compression timestamp inhabited_time "
+                                            "last_update entities tile_entities data_version")):
+    __slots__ = ()
+
+    @property
+    def region(self):
+        return self.x >> 5, self.z >> 5
+
+
+def _in_box(x, z, box):
+    (x_start, x_end), (z_start, z_end) = box
+    return x_start <= x <= x_end and z_start <= z <= z_end
+
+
+def chunk_record(region, x, z, rx, rz):
+    """Summarise chunk (x, z) of an open region file of region (rx, rz), None if it cannot be read."""
+    offset = region.get_offset(x, z)
+    chunk = region.read_chunk_versioned(x, z)
+    if chunk is None:
+        return None
+    version, data = chunk
+    found = nbt.extract(data.stream.bytearr, _summary_paths, lazy=True)
+    value = lambda old, new: found.get(old, found.get(new, -1))
+    count = lambda old, new: len(value(old, new)) if old in found or new in found else -1
+    return ChunkRecord(rx * 32 + x, rz * 32 + z, offset >> 8, offset & 0xFF, version, region.get_timestamp(x, z),
+                       value("Level.InhabitedTime", "InhabitedTime"), value("Level.LastUpdate", "LastUpdate"),
+                       count("Level.Entities", "entities"), count("Level.TileEntities", "block_entities"),
+                       found.get("DataVersion", -1))
+
+
+def region_records(file_name, old=()):
+    """Records of all chunks of a region file. Records from old (of the same region) are reused
+    for chunks with unchanged timestamp and sector count, without reading the chunk."""
+    rx, rz = region_file.region_coords(file_name)
+    reuse = {(r.x, r.z): r for r in old}
+    records = []
+    region = region_file.RegionFile(file_name, read_only=True)
+    try:
+        for i in range(0, 1024):
+            offset = region.offsets[i]
+            if offset == 0:
+                continue
+            x = i % 32
+            z = i // 32
+            record = reuse.get((rx * 32 + x, rz * 32 + z))
+            if record is not None and record.timestamp == region.chunkTimestamps[i] \
+                    and record.sectors == offset & 0xFF:
+                records.append(record._replace(sector=offset >> 8))
+                continue
+            try:
+                record = chunk_record(region, x, z, rx, rz)
+            except Exception as e:
+                print(f"{file_name} {x, z}: {e}")
+                continue
+            if record is not None:
+                records.append(record)
+    finally:
+        region.close()
+    return records
+
+
+class ChunkIndex:
+
+    def __init__(self, save_dir, path=None):
+        self.saveDir = save_dir
+        self.path = os.path.join(save_dir, index_name) if path is None else path
+        # (rx, rz) -> (mtime_ns, rozmiar pliku, [ChunkRecord])
+        self.regions = {}
+
+    @staticmethod
+    def load(save_dir, path=None):
+        """Index of a world as saved last time; empty if there is none. Call update() to bring it up to date."""
+        index = ChunkIndex(save_dir, path)
+        if not os.path.exists(index.path):
+            return index
+        with open(index.path, "rb") as f:
+            data = f.read()
+        magic, version, count = header_struct.unpack_from(data, 0)
+        if magic != index_magic or version != index_version:
+            print(f"Index {index.path} ignored: unknown format")
+            return index
+        pos = header_struct.size
+        for i in range(0, count):
+            rx, rz, mtime, size, n = region_struct.unpack_from(data, pos)
+            pos += region_struct.size
+            end = pos + n * record_struct.size
+            records = list(map(ChunkRecord._make, record_struct.iter_unpack(data[pos:end])))
+            index.regions[(rx, rz)] = (mtime, size, records)
+            pos = end
+        return index
+
+    def save(self):
+        out = bytearray(header_struct.pack(index_magic, index_version, len(self.regions)))
+        for (rx, rz), (mtime, size, records) in sorted(self.regions.items()):
+            out += region_struct.pack(rx, rz, mtime, size, len(records))
+            for record in records:
+                out += record_struct.pack(*record)
+        temp_name = self.path + ".tmp"
+        with open(temp_name, "wb") as f:
+            f.write(out)
+        os.replace(temp_name, self.path)
+
+    def update(self, extension="mca"):
+        """Re-index region files modified since the last update and drop removed ones.
+        Returns the number of region files read."""
+        found = set()
+        read = 0
+        for f in os.listdir(self.saveDir):
+            coords = region_file.region_coords(f)
+            if coords is None or not f.endswith("." + extension):
+                continue
+            found.add(coords)
+            path = os.path.join(self.saveDir, f)
+            stat = os.stat(path)
+            entry = self.regions.get(coords)
+            if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                continue
+            self.regions[coords] = (stat.st_mtime_ns, stat.st_size, region_records(path, () if entry is None else entry[2]))
+            read += 1
+        for coords in set(self.regions) - found:
+            del self.regions[coords]
+        return read
+
+    def records(self):
+        for mtime, size, records in self.regions.values():
+            yield from records
+
+    def get(self, xc, zc):
+        entry = self.regions.get((xc >> 5, zc >> 5))
+        if entry is not None:
+            for record in entry[2]:
+                if record.x == xc and record.z == zc:
+                    return record
+        return None
+
+    def query(self, where=None, inside=None, outside=None):
+        """Records matching all given conditions: where(record) is true, the chunk lies inside
+        the box or outside the box. Boxes are in chunk coordinates, inclusive: ((startX, endX), (startZ, endZ)).
+
+        E.g. query(lambda r: r.inhabited_time < 1200, outside=((-37, -12), (9, 30)))
+        """
+        for (rx, rz), (mtime, size, records) in self.regions.items():
+            if inside is not None:
+                (x_start, x_end), (z_start, z_end) = inside
+                if rx * 32 > x_end or rx * 32 + 31 < x_start or rz * 32 > z_end or rz * 32 + 31 < z_start:
+                    continue
+            if outside is not None and _in_box(rx * 32, rz * 32, outside) and _in_box(rx * 32 + 31, rz * 32 + 31, outside):
+                continue
+            for record in records:
+                if inside is not None and not _in_box(record.x, record.z, inside):
+                    continue
+                if outside is not None and _in_box(record.x, record.z, outside):
+                    continue
+                if where is None or where(record):
+                    yield record
@@ -0,0 +1,176 @@
+"""
+Block states of chunk sections: bit-packed palette indices stored in long arrays.
+
+Since 1.13 a section keeps its blocks as a palette (list of block state compounds) and
+4096 indices into it, packed into a LongArray with bits_per_entry bits per index:
+
+ - 1.13 - 1.15 ("spanning"): the indices form one continuous bit stream, an index may
+   start in one long and end in the next one,
+ - 1.16+ ("padded"): every long holds 64 // bits_per_entry whole indices, the remaining
+   high bits are unused.
+
+Before 1.18 they are the section's "Palette" and "BlockStates" tags, since 1.18 the
+"palette" and "data" tags of its "block_states" compound ("data" is left out when the
+palette has a single entry).
+
+The codec works on whole groups at once - 8 indices in bits_per_entry bytes of the
+spanning layout, or one long of the padded layout - using NumPy when it is installed.
+Unpacked indices are a numpy.ndarray (uint16) then, otherwise an array.array('H').
+"""
+import sys
+from array import array
+import nbt_lib as nbt
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+section_blocks = 4096
+_big_endian = sys.byteorder == "big"
+
+
+def bits_per_entry(palette_size, min_bits=4):
+    return max(min_bits, (palette_size - 1).bit_length())
+
+
+def packed_length(bits, count=section_blocks, padded=True):
+    """Number of longs holding count indices of the given size."""
+    if padded:
+        per_long = 64 // bits
+        return (count + per_long - 1) // per_long
+    return (count * bits + 63) // 64
+
+
+def _to_bytes(longs):
+    # Strumień bitów: kolejne longi, każdy little-endian
+    longs = array('q', longs) if not isinstance(longs, array) else longs[:]
+    if _big_endian:
+        longs.byteswap()
+    return longs.tobytes()
+
+
+def _from_bytes(data):
+    longs = array('q')
+    longs.frombytes(data)
+    if _big_endian:
+        longs.byteswap()
+    return longs
+
+
+def unpack(longs, bits, count=section_blocks, padded=True):
+    """Unpack count indices of the given size from a long array."""
+    data = _to_bytes(longs)
+    mask = (1 << bits) - 1
+    if numpy is not None:
+        if padded:
+            shifts = numpy.arange(64 // bits, dtype=numpy.uint64) * numpy.uint64(bits)
+            values = (numpy.frombuffer(data, dtype="<u8")[:, None] >> shifts) & numpy.uint64(mask)
+        else:
+            stream = numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8), bitorder="little")
+            stream = stream[:count * bits].reshape(count, bits).astype(numpy.uint32)
+            values = (stream << numpy.arange(bits, dtype=numpy.uint32)).sum(axis=1)
+        return values.reshape(-1)[:count].astype(numpy.uint16)
+    group, per_group = (8, 64 // bits) if padded else (bits, 8)
+    groups = [int.from_bytes(data[i:i + group], "little") for i in range(0, len(data), group)]
+    out = array('H', bytes(2 * len(groups) * per_group))
+    for j in range(0, per_group):
+        shift = j * bits
+        out[j::per_group] = array('H', [(g >> shift) & mask for g in groups])
+    return out[:count]
+
+
+def pack(indices, bits, padded=True):
+    """Pack indices of the given size into a long array, array.array('q')."""
+    count = len(indices)
+    if numpy is not None:
+        indices = numpy.asarray(indices, dtype=numpy.uint64)
+        if padded:
+            per_long = 64 // bits
+            values = numpy.zeros(packed_length(bits, count) * per_long, dtype=numpy.uint64)
+            values[:count] = indices
+            shifts = numpy.arange(per_long, dtype=numpy.uint64) * numpy.uint64(bits)
+            data = numpy.bitwise_or.reduce(values.reshape(-1, per_long) << shifts, axis=1).astype("<u8").tobytes()
+        else:
+            stream = ((indices[:, None] >> numpy.arange(bits, dtype=numpy.uint64)) & numpy.uint64(1)).astype(numpy.uint8)
+            data = numpy.packbits(stream.reshape(-1), bitorder="little").tobytes()
+    else:
+        group, per_group = (8, 64 // bits) if padded else (bits, 8)
+        n_groups = (count + per_group - 1) // per_group
+        values = array('H', indices)
+        values.extend(array('H', bytes(2 * (n_groups * per_group - count))))
+        groups = [0] * n_groups
+        for j in range(0, per_group):
+            shift = j * bits
+            groups = [g | (v << shift) for g, v in zip(groups, values[j::per_group])]
+        data = b"".join(g.to_bytes(group, "little") for g in groups)
+        # Całe grupy po 8 indeksów - ostatnia może wychodzić poza potrzebne longi
+        data = data[:packed_length(bits, count, padded) * 8]
+    return _from_bytes(data + bytes(-len(data) % 8))
+
+
+def _container(section):
+    if section.contains("block_states"):
+        return section.get("block_states"), "palette", "data"
+    return section, "Palette", "BlockStates"
+
+
+def _layout(length, palette_size, count, min_bits):
+    """Bits per entry and padding of a long array of the given length."""
+    bits = bits_per_entry(palette_size, min_bits)
+    if length == packed_length(bits, count, True):
+        return bits, True
+    if length == packed_length(bits, count, False):
+        return bits, False
+    for bits in range(1, 33):
+        if length == packed_length(bits, count, True):
+            return bits, True
+        if length == packed_length(bits, count, False):
+            return bits, False
+    raise IOError(f"Block states of unknown layout: {length} longs for {palette_size} palette entries")
+
+
+def read_blocks(section):
+    """Return (indices, palette) of a section: 4096 palette indices in YZX order and the palette List tag."""
+    container, palette_name, data_name = _container(section)
+    palette = container.get_tag(palette_name)
+    if not container.contains(data_name):
+        if numpy is not None:
+            return numpy.zeros(section_blocks, dtype=numpy.uint16), palette
+        return array('H', bytes(2 * section_blocks)), palette
+    longs = container.get(data_name)
+    bits, padded = _layout(len(longs), len(palette.data), section_blocks, 4)
+    return unpack(longs, bits, section_blocks, padded), palette
+
+
+def write_blocks(section, indices, palette, padded=None):
+    """Store indices and palette (List tag or list of block state compounds) in a section.
+
+    Palette entries that are not used are dropped and bits per entry is recomputed.
+    padded=None keeps the layout the section already has (padded for a new one).
+    """
+    container, palette_name, data_name = _container(section)
+    entries = list(palette.data if isinstance(palette, nbt.List) else palette)
+    if padded is None:
+        padded = True
+        if container.contains(data_name) and container.contains(palette_name):
+            old = container.get(data_name)
+            padded = _layout(len(old), len(container.get_tag(palette_name).data), section_blocks, 4)[1]
+    if numpy is not None:
+        used, indices = numpy.unique(numpy.asarray(indices), return_inverse=True)
+        used = used.tolist()
+    else:
+        used = sorted(set(indices))
+        if used != list(range(0, len(used))):
+            remap = [0] * len(entries)
+            for i, u in enumerate(used):
+                remap[u] = i
+            indices = array('H', [remap[v] for v in indices])
+    palette = nbt.List(palette_name)
+    for u in used:
+        palette.put(entries[u])
+    container.put(palette)
+    if len(used) == 1 and data_name == "data":
+        container.remove(data_name)
+        return
+    container.put(nbt.LongArray(data_name, pack(indices, bits_per_entry(len(used)), padded)))
@@ -1,6 +1,73 @@
 import gzip
+import sys
+from array import array
 from struct import *
 
+# Java zapisuje liczby w big-endian, tablice trzeba odwrócić na maszynach little-endian
+_swap_arrays = sys.byteorder == "little"
+_numpy_formats = {'b': '>i1', 'h': '>i2', 'i': '>i4', 'q': '>i8', 'f': '>f4', 'd': '>f8'}
+
+
+def array_from_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if _swap_arrays:
+        values.byteswap()
+    return values
+
+
+def array_to_bytes(typecode, values):
+    if hasattr(values, "astype"):
+        # numpy.ndarray - jedna konwersja do big-endian
+        return values.astype(_numpy_formats[typecode]).tobytes()
+    if isinstance(values, array) and values.typecode == typecode:
+        if not _swap_arrays:
+            return values.tobytes()
+        values = values[:]
+    else:
+        values = array(typecode, values)
+    if _swap_arrays:
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_utf(string):
+    """Encode to Java's modified UTF-8: NUL takes two bytes and characters outside
+    the BMP are written as two 3-byte surrogates."""
+    if "\0" not in string:
+        if string.isascii():
+            return string.encode("ascii")
+        if max(string) < "\U00010000":
+            try:
+                return string.encode("utf-8")
+            except UnicodeEncodeError:
+                pass  # pojedyncze surogaty
+    buf = bytearray()
+    units = string.encode("utf-16-be", "surrogatepass")
+    for i in range(0, len(units), 2):
+        c = (units[i] << 8) | units[i + 1]
+        if 0x0001 <= c <= 0x007f:
+            buf.append(c)
+        elif c <= 0x07ff:
+            buf.append(0xc0 | (0x1f & (c >> 6)))
+            buf.append(0x80 | (0x3f & c))
+        else:
+            buf.append(0xe0 | (0x0f & (c >> 12)))
+            buf.append(0x80 | (0x3f & (c >> 6)))
+            buf.append(0x80 | (0x3f & c))
+    return bytes(buf)
+
+
+def decode_utf(data):
+    """Decode Java's modified UTF-8, see encode_utf."""
+    try:
+        return str(data, "utf-8")
+    except UnicodeDecodeError:
+        pass
+    string = bytes(data).replace(b"\xc0\x80", b"\x00").decode("utf-8", "surrogatepass")
+    # Połącz pary surogatów w znaki spoza BMP
+    return string.encode("utf-16-be", "surrogatepass").decode("utf-16-be", "surrogatepass")
+
 
 class DataIO:
     def __init__(self, stream):
@@ -35,7 +102,7 @@ class DataIO:
 
     def read_utf(self):
         utf_length = self.read_unsigned_short()
-        return self.stream.read(utf_length).decode("utf-8")
+        return decode_utf(self.stream.read(utf_length))
 
     def read_int(self):
         return unpack('>i', self.stream.read(4))[0]
@@ -43,6 +110,12 @@ class DataIO:
     def read(self, length):
         return self.stream.read(length)
 
+    def read_int_array(self, length):
+        return array_from_bytes('i', self.stream.read(length * 4))
+
+    def read_long_array(self, length):
+        return array_from_bytes('q', self.stream.read(length * 8))
+
     def write_boolean(self, bool):
         self.stream.write(pack('?', bool))
 
@@ -70,51 +143,12 @@ class DataIO:
     def write_long(self, val):
         self.stream.write(pack('>q', val))
 
-    @staticmethod
-    def __utf_length(self, string, start, sum):
-        le = len(string)
-        i = start
-        while i < le and sum <= 65535:
-            c = string[i]
-            i += 1
-            if '\u0001' <= c <= '\u007f':
-                sum += 1
-            elif c == '\u0000' or ('\u0080' <= c <= '\u07ff'):
-                sum += 2
-            else:
-                sum += 3
-        if sum > 65536:
-            print("Danusia we have a problem")
-        return sum
-
     def write_utf(self, string):
-        le = len(string)
-        i = 0
-        length_written = False
-        buf_len = 512
-        while True:
-            buf = bytearray()
-            while i < le and len(buf) < buf_len - 3:
-                c = string[i]
-                i += 1
-                if '\u0001' <= c <= '\u007f':
-                    buf.append(ord(c))
-                elif c == '\u0000' or ('\u0080' <= c <= '\u07ff'):
-                    buf.append(0xc0 | (0x1f & (ord(c) >> 6)))
-                    buf.append(0x80 | (0x3f & ord(c)))
-                else:
-                    buf.append(0xe0 | (0x0f & (ord(c) >> 12)))
-                    buf.append(0x80 | (0x3f & (ord(c) >> 6)))
-                    buf.append(0x80 | (0x3f & ord(c)))
-            if not length_written:
-                if i == le:
-                    self.write_short(len(buf))
-                else:
-                    self.write_short(self.__getUTFLength(string, i, len(buf)))
-                length_written = True
-            self.stream.write(buf)
-            if i >= le:
-                break
+        data = encode_utf(string)
+        if len(data) > 65535:
+            raise IOError(f"Encoded string too long: {len(data)} bytes")
+        self.write_unsigned_short(len(data))
+        self.stream.write(data)
 
     def write_int(self, val):
         self.stream.write(pack('>i', val))
@@ -122,6 +156,12 @@ class DataIO:
     def write(self, bytes):
         self.stream.write(bytes)
 
+    def write_int_array(self, values):
+        self.stream.write(array_to_bytes('i', values))
+
+    def write_long_array(self, values):
+        self.stream.write(array_to_bytes('q', values))
+
     def flush(self):
         self.stream.flush()
 
@@ -194,3 +234,16 @@ class ByteArrayIO:
 
     def close(self):
         pass
+
+
+class BufferIO(ByteArrayIO):
+    """Read-only in-memory source: read() hands out memoryview slices of the data instead of copies.
+
+    The slices keep the whole buffer alive as long as they are referenced.
+    """
+
+    def __init__(self, data):
+        ByteArrayIO.__init__(self, memoryview(data).toreadonly())
+
+    def write(self, bytes):
+        raise IOError("BufferIO is read-only")
@@ -0,0 +1,86 @@
+"""
+Manifest - state of a world's region files as left by the last processing run.
+
+One sidecar JSON file in the world's region directory records, per region file, its
+modification time and size and, per chunk, the header timestamp and a hash of the
+compressed payload. A job run again over the world can then skip region files that
+were not modified since, and chunks whose timestamp and payload did not change.
+"""
+import json, os, zlib
+import region_file
+
+manifest_name = "###Python_Optimizer_Manifest.json"
+
+
+def payload_hash(payload):
+    return zlib.crc32(payload)
+
+
+def region_state(file_name):
+    """{chunk index (x + z * 32): (timestamp, payload hash)} of all chunks of a region file."""
+    region = region_file.RegionFile(file_name, read_only=True)
+    chunks = {}
+    try:
+        for i in range(0, 1024):
+            if region.offsets[i] == 0:
+                continue
+            raw = region.read_chunk_raw(i % 32, i // 32)
+            if raw is not None:
+                chunks[i] = (raw[2], payload_hash(raw[1]))
+    finally:
+        region.close()
+    return chunks
+
+
+def _file_key(file_name):
+    stat = os.stat(file_name)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class Manifest:
+
+    def __init__(self, path):
+        self.path = path
+        # Nazwa pliku regionu (względem katalogu świata) -> {"file": [mtime_ns, size], "chunks": {...}}
+        self.regions = {}
+
+    @staticmethod
+    def load(save_dir):
+        """Manifest of a world; empty if there is none yet or it cannot be read."""
+        manifest = Manifest(os.path.join(save_dir, manifest_name))
+        try:
+            with open(manifest.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for name, entry in data["regions"].items():
+                chunks = {int(i): tuple(state) for i, state in entry["chunks"].items()}
+                manifest.regions[name] = {"file": entry["file"], "chunks": chunks}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Manifest {manifest.path} ignored: {e}")
+            manifest.regions = {}
+        return manifest
+
+    def save(self):
+        data = {"regions": {name: {"file": entry["file"],
+                                   "chunks": {str(i): list(state) for i, state in entry["chunks"].items()}}
+                            for name, entry in self.regions.items()}}
+        temp_name = self.path + ".tmp"
+        with open(temp_name, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(temp_name, self.path)
+
+    def unchanged(self, name, file_name):
+        """Whether the region file was not modified since it was recorded."""
+        entry = self.regions.get(name)
+        return entry is not None and entry["file"] == _file_key(file_name)
+
+    def chunks(self, name):
+        """Recorded {chunk index: (timestamp, payload hash)} of a region, None if it is not known."""
+        entry = self.regions.get(name)
+        return None if entry is None else entry["chunks"]
+
+    def record(self, name, file_name):
+        self.regions[name] = {"file": _file_key(file_name), "chunks": region_state(file_name)}
+
+    def forget(self, name):
+        self.regions.pop(name, None)
@@ -1,17 +1,30 @@
 __author__ = 'Karol'
 
+import copy
+import hashlib
+import sys
+from array import array
+from collections.abc import MutableSequence
+from struct import Struct
+from types import MappingProxyType
 import java_data_io as dio
 
 tagId = (
     "End", "Byte", "Short", "Int", "Long", "Float", "Double", "Byte_Array", "String", "List", "Compound", "Int_Array",
     "Long_Array")
 
+# Zdarzenia zwracane przez iter_events
+START_COMPOUND = "start_compound"
+START_LIST = "start_list"
+VALUE = "value"
+END = "end"
+
 
 def _read_named_tag(datain):
     id = datain.read_byte()
     if id == 0:
         return End()
-    name = datain.read_utf()
+    name = sys.intern(datain.read_utf())
     tag = create_tag(id, name)
     tag.read(datain)
     return tag
@@ -25,8 +38,18 @@ def _write_named_tag(tag, dataos):
     tag.write(dataos)
 
 
-def read(datais):
-    tag = _read_named_tag(datais)
+def read(datais, lazy=False):
+    """Read a root compound from a DataIO.
+
+    lazy=True only applies to streams already in memory (ByteArrayIO, e.g. chunks from
+    RegionFile.read_chunk); other streams are always decoded fully, use read_bytes for those.
+    """
+    stream = getattr(datais, "stream", None)
+    if isinstance(stream, dio.ByteArrayIO):
+        # Dane są już w pamięci - parsuj bezpośrednio z bufora
+        tag, stream.offset = _decode_named_tag(stream.bytearr, stream.offset, lazy)
+    else:
+        tag = _read_named_tag(datais)
     if isinstance(tag, Compound):
         return tag
     raise IOError("Root tag must be a named compound tag")
@@ -36,10 +59,197 @@ def read_is(input_stream):
     return read(dio.DataIO(input_stream))
 
 
-def write(root, dataout, close = True):
+def read_bytes(buf, lazy=False):
+    """Decode a root compound straight from a bytes-like object (bytes, bytearray, memoryview).
+
+    With lazy=True compounds are returned as LazyCompound, which keep a reference to buf,
+    so buf must not be modified while the tree is in use. For read-only buffers (bytes,
+    read-only memoryview) ByteArray payloads are views of buf until their data is accessed.
+    """
+    if isinstance(buf, bytes):
+        buf = memoryview(buf)
+    tag, pos = _decode_named_tag(buf, 0, lazy)
+    if isinstance(tag, Compound):
+        return tag
+    raise IOError("Root tag must be a named compound tag")
+
+
+def extract(buf, paths, lazy=False):
+    """Decode only the given dotted paths (e.g. "Level.xPos") of a root compound held in buf.
+
+    Returns a dict mapping each path found to its value, as Compound.get would return it;
+    everything not on a requested path is skipped by its length without decoding.
+    With lazy=True the values found are decoded lazily, as in read_bytes.
+    """
+    wanted = {}
+    for path in paths:
+        node = wanted
+        keys = path.split(".")
+        for key in keys[:-1]:
+            node = node.setdefault(key, [None, {}])[1]
+        node.setdefault(keys[-1], [None, {}])[0] = path
+    if buf[0] != 10:
+        raise IOError("Root tag must be a named compound tag")
+    result = {}
+    _extract_compound(buf, 3 + _ushort.unpack_from(buf, 1)[0], wanted, result, len(set(paths)), lazy)
+    return result
+
+
+def iter_events(source):
+    """Stream a root compound from a DataIO or a bytes-like object as a sequence of events:
+
+    (START_COMPOUND, name), (START_LIST, name, type, length), (VALUE, name, type, value), (END,)
+
+    Every START_COMPOUND and START_LIST is closed by a matching END. Elements of lists have
+    name None. Nesting is tracked on an explicit stack, so memory use is bounded by the depth
+    of the current path and deeply nested data does not hit the recursion limit.
+    """
+    datais = source if isinstance(source, dio.DataIO) else dio.DataIO(dio.BufferIO(source))
+    if datais.read_byte() != 10:
+        raise IOError("Root tag must be a named compound tag")
+    yield START_COMPOUND, datais.read_utf()
+    # None - wnętrze compounda, [typ, pozostało] - wnętrze listy
+    stack = [None]
+    while stack:
+        frame = stack[-1]
+        if frame is None:
+            id = datais.read_byte()
+            if id == 0:  # TAG_End
+                stack.pop()
+                yield END,
+                continue
+            name = datais.read_utf()
+        else:
+            if frame[1] <= 0:
+                stack.pop()
+                yield END,
+                continue
+            frame[1] -= 1
+            id = frame[0]
+            name = None
+        if id == 10:
+            stack.append(None)
+            yield START_COMPOUND, name
+        elif id == 9:
+            type = datais.read_byte()
+            size = datais.read_int()
+            stack.append([type, size])
+            yield START_LIST, name, type, size
+        else:
+            tag = create_tag(id, name)
+            tag.read(datais)
+            yield VALUE, name, id, tag.data
+
+
+class Writer:
+    """Writes NBT incrementally to a DataIO (or appends to a bytearray), without building a tree.
+
+    Compounds and lists are opened with begin_compound / begin_list and closed with end();
+    both return the writer, so they can also be used as context managers:
+
+        with writer.begin_compound("Level"):
+            writer.write_value(3, -5, "xPos")
+            with writer.begin_list(10, len(entities), "Entities"):
+                for entity in entities:
+                    writer.write_tag(entity)
+
+    A with block closes only the tag opened by the begin_* call it was given, and nothing
+    if that tag was already closed with end(); "with Writer(out) as w:" closes nothing.
+    List elements are written without names; the declared element count is enforced.
+    The root compound may be opened without a name, it is then written with an empty one.
+    """
+
+    def __init__(self, dataout):
+        if isinstance(dataout, bytearray):
+            dataout = dio.DataIO(dio.ByteArrayIO(dataout))
+            dataout.seek(len(dataout.stream.bytearr))
+        self.dataos = dataout
+        # None - wnętrze compounda, [typ, pozostało] - wnętrze listy
+        self.stack = []
+        self.entered = []
+
+    def _begin(self, id, name):
+        if not self.stack:
+            if id != 10:
+                raise IOError("Root tag must be a named compound tag")
+            if name is None:
+                name = ""
+        elif self.stack[-1] is not None:
+            frame = self.stack[-1]
+            if frame[0] != id:
+                raise AttributeError(f"Adding {tagId[id]} tag to list of {tagId[frame[0]]}")
+            if frame[1] <= 0:
+                raise IOError("List already holds all of its declared elements")
+            frame[1] -= 1
+            return
+        elif name is None:
+            raise IOError(f"{tagId[id]} tag in a compound needs a name")
+        self.dataos.write_byte(id)
+        self.dataos.write_utf(name)
+
+    def begin_compound(self, name=None):
+        self._begin(10, name)
+        self.stack.append(None)
+        return self
+
+    def begin_list(self, type, count, name=None):
+        self._begin(9, name)
+        self.dataos.write_byte(type)
+        self.dataos.write_int(count)
+        self.stack.append([type, count])
+        return self
+
+    def write_value(self, type, value, name=None):
+        tag = create_tag(type, name)
+        tag.data = value
+        self.write_tag(tag)
+
+    def write_tag(self, tag):
+        self._begin(tag.get_id(), tag.name)
+        tag.write(self.dataos)
+
+    def write_events(self, events):
+        """Write a sequence of events as produced by iter_events."""
+        for event in events:
+            kind = event[0]
+            if kind == VALUE:
+                self.write_value(event[2], event[3], event[1])
+            elif kind == START_COMPOUND:
+                self.begin_compound(event[1])
+            elif kind == START_LIST:
+                self.begin_list(event[2], event[3], event[1])
+            else:
+                self.end()
+
+    def end(self):
+        frame = self.stack.pop()
+        if frame is None:
+            self.dataos.write_byte(0)
+        elif frame[1] != 0:
+            raise IOError(f"List is missing {frame[1]} declared elements")
+
+    def __enter__(self):
+        # Głębokość w chwili wejścia - with po begin_* zamyka tylko otwarty przez nie tag
+        self.entered.append(len(self.stack))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        depth = self.entered.pop()
+        if exc_type is None and depth > 0 and len(self.stack) == depth:
+            self.end()
+
+
+def write_bytes(root):
+    """Encode a root compound into a bytearray of exactly its serialised size."""
     if root.get_id() != 10:
         raise IOError("Root tag must be a named compound tag")
-    _write_named_tag(root, dataout)
+    buf = bytearray(_named_size(root))
+    _pack_named(root, buf, 0)
+    return buf
+
+
+def write(root, dataout, close = True):
+    dataout.write(write_bytes(root))
     if close:
         dataout.close()
 
@@ -86,6 +296,8 @@ def create_tag(id, name):
 
 
 class Tag:
+    __slots__ = ("name", "data")
+
     def __init__(self, name, data):
         self.name = name
         self.data = data
@@ -95,12 +307,20 @@ class Tag:
 
 
 class End(Tag):
+    __slots__ = ()
+
     def __init__(self): pass
 
     def write(self, dataos): pass
 
     def read(self, datais): pass
 
+    def payload_size(self):
+        return 0
+
+    def pack_into(self, buf, pos):
+        return pos
+
     def get_id(self):
         return 0
 
@@ -109,93 +329,191 @@ class End(Tag):
 
 
 class Byte(Tag):
+    __slots__ = ()
+
     def write(self, dataos):
         dataos.write_byte(self.data)
 
     def read(self, datais):
         self.data = datais.read_byte()
 
+    def payload_size(self):
+        return 1
+
+    def pack_into(self, buf, pos):
+        _byte.pack_into(buf, pos, self.data)
+        return pos + 1
+
     def get_id(self):
         return 1
 
 
 class Short(Tag):
+    __slots__ = ()
+
     def write(self, dataos):
         dataos.write_short(self.data)
 
     def read(self, datais):
         self.data = datais.read_short()
 
+    def payload_size(self):
+        return 2
+
+    def pack_into(self, buf, pos):
+        _short.pack_into(buf, pos, self.data)
+        return pos + 2
+
     def get_id(self):
         return 2
 
 
 class Int(Tag):
+    __slots__ = ()
+
     def write(self, dataos):
         dataos.write_int(self.data)
 
     def read(self, datais):
         self.data = datais.read_int()
 
+    def payload_size(self):
+        return 4
+
+    def pack_into(self, buf, pos):
+        _int.pack_into(buf, pos, self.data)
+        return pos + 4
+
     def get_id(self):
         return 3
 
 
 class Long(Tag):
+    __slots__ = ()
+
     def write(self, dataos):
         dataos.write_long(self.data)
 
     def read(self, datais):
         self.data = datais.read_long()
 
+    def payload_size(self):
+        return 8
+
+    def pack_into(self, buf, pos):
+        _long.pack_into(buf, pos, self.data)
+        return pos + 8
+
     def get_id(self):
         return 4
 
 
 class Float(Tag):
+    __slots__ = ()
+
     def write(self, dataos):
         dataos.write_float(self.data)
 
     def read(self, datais):
         self.data = datais.read_float()
 
+    def payload_size(self):
+        return 4
+
+    def pack_into(self, buf, pos):
+        _float.pack_into(buf, pos, self.data)
+        return pos + 4
+
     def get_id(self):
         return 5
 
 
 class Double(Tag):
+    __slots__ = ()
+
     def write(self, dataos):
         dataos.write_double(self.data)
 
     def read(self, datais):
         self.data = datais.read_double()
 
+    def payload_size(self):
+        return 8
+
+    def pack_into(self, buf, pos):
+        _double.pack_into(buf, pos, self.data)
+        return pos + 8
+
     def get_id(self):
         return 6
 
 
+# Bezpośredni dostęp do slotu data, z pominięciem właściwości ByteArray.data
+_tag_data = Tag.data
+
+
 class ByteArray(Tag):
+    """Byte array. When read from a read-only buffer the bytes are first kept as a view of it,
+    so tags that are only passed through are written back without copying; the first access
+    to data copies them into a bytearray."""
+    __slots__ = ()
+
+    @property
+    def data(self):
+        value = _tag_data.__get__(self)
+        if isinstance(value, memoryview):
+            value = bytearray(value)
+            _tag_data.__set__(self, value)
+        return value
+
+    @data.setter
+    def data(self, value):
+        _tag_data.__set__(self, value)
+
+    def __reduce__(self):
+        return ByteArray, (self.name, self.data)
+
     def write(self, dataos):
-        dataos.write_int(len(self.data))
-        dataos.write(self.data)
+        data = _tag_data.__get__(self)
+        dataos.write_int(len(data))
+        dataos.write(data)
 
     def read(self, datais):
         self.data = datais.read(datais.read_int())
 
+    def payload_size(self):
+        return 4 + len(_tag_data.__get__(self))
+
+    def pack_into(self, buf, pos):
+        data = _tag_data.__get__(self)
+        length = len(data)
+        _int.pack_into(buf, pos, length)
+        pos += 4
+        buf[pos:pos + length] = data
+        return pos + length
+
     def get_id(self):
         return 7
 
     def __str__(self):
-        return "[" + str(len(self.data)) + " bytes]"
+        return "[" + str(len(_tag_data.__get__(self))) + " bytes]"
 
 
 class String(Tag):
+    __slots__ = ()
+
     def write(self, dataos):
         dataos.write_utf(self.data)
 
     def read(self, datais):
         self.data = datais.read_utf()
 
+    def payload_size(self):
+        return _utf_size(self.data)
+
+    def pack_into(self, buf, pos):
+        return _pack_utf(self.data, buf, pos)
+
     def get_id(self):
         return 8
 
@@ -203,11 +521,83 @@ class String(Tag):
         return self.data
 
 
+# Listy liczb trzymane jako jedna tablica: typ tagu -> typecode modułu array
+_list_typecodes = {1: 'b', 2: 'h', 3: 'i', 4: 'q', 5: 'f', 6: 'd'}
+
+
+class _PrimitiveTags(MutableSequence):
+    """Elements of a List of numeric tags kept as one typed array.
+
+    The tags are created all at once on first access to the elements and from then on
+    kept like in a plain list, so changes of their data change the list. Lists only read
+    and written back never create them.
+    """
+    __slots__ = ("type", "values", "tags")
+
+    def __init__(self, type, values):
+        self.type = type
+        self.values = values
+        self.tags = None
+
+    @staticmethod
+    def from_bytes(type, data):
+        return _PrimitiveTags(type, dio.array_from_bytes(_list_typecodes[type], data))
+
+    def to_bytes(self):
+        values = self.values if self.tags is None else [tag.data for tag in self.tags]
+        return dio.array_to_bytes(_list_typecodes[self.type], values)
+
+    def _boxed(self):
+        if self.tags is None:
+            cls = _tag_classes[self.type]
+            self.tags = [cls(None, value) for value in self.values]
+            self.values = None
+        return self.tags
+
+    def _check(self, tag):
+        if tag.get_id() != self.type:
+            raise AttributeError(f"Adding {tagId[tag.get_id()]} tag to list of {tagId[self.type]}")
+        return tag
+
+    def __len__(self):
+        return len(self.values) if self.tags is None else len(self.tags)
+
+    def __getitem__(self, i):
+        return self._boxed()[i]
+
+    def __setitem__(self, i, tag):
+        if isinstance(i, slice):
+            tag = [self._check(t) for t in tag]
+        else:
+            self._check(tag)
+        self._boxed()[i] = tag
+
+    def __delitem__(self, i):
+        if self.tags is None:
+            del self.values[i]
+        else:
+            del self.tags[i]
+
+    def __iter__(self):
+        return iter(self._boxed())
+
+    def insert(self, i, tag):
+        self._boxed().insert(i, self._check(tag))
+
+    def clear(self):
+        if self.tags is None:
+            del self.values[:]
+        else:
+            self.tags.clear()
+
+
 def is_empty(list_inst):
     return list_inst.data is None or len(list_inst.data) == 0
 
 
 class List(Tag):
+    __slots__ = ("type",)
+
     def __init__(self, name):
         self.name = name
         self.data = []
@@ -216,8 +606,8 @@ class List(Tag):
     def put(self, tag):
         if is_empty(self):
             self.data = []
-        elif self.data[0].get_id() != tag.get_id():
-            raise AttributeError(f"Adding {tagId[tag.get_id()]} tag to list of {tagId[self.data[0].get_id()]}")
+        elif self.element_type() != tag.get_id():
+            raise AttributeError(f"Adding {tagId[tag.get_id()]} tag to list of {tagId[self.element_type()]}")
         self.data.append(tag)
 
     def get(self, i):
@@ -226,25 +616,56 @@ class List(Tag):
     def get_type(self):
         return self.type
 
-    def write(self, dataos):
+    def element_type(self):
+        """Tag type of the elements as they are now, 0 for an empty list."""
         if is_empty(self):
-            self.type = 0
-        else:
-            self.type = self.data[0].get_id()
+            return 0
+        # Lista liczb zna swój typ - bez tworzenia tagów elementów
+        return self.data.type if isinstance(self.data, _PrimitiveTags) else self.data[0].get_id()
+
+    def write(self, dataos):
+        self.type = self.element_type()
         dataos.write_byte(self.type)
         dataos.write_int(len(self.data))
+        if isinstance(self.data, _PrimitiveTags):
+            dataos.write(self.data.to_bytes())
+            return
         for tag in self.data:
             tag.write(dataos)
 
     def read(self, datais):
         self.type = datais.read_byte()
         size = datais.read_int()
+        if self.type in _list_typecodes and size > 0:
+            self.data = _PrimitiveTags.from_bytes(self.type, datais.read(size * _fixed_sizes[self.type]))
+            return
         self.data = []
         for x in range(0, size):
             tag = create_tag(self.type, None)
             tag.read(datais)
             self.data.append(tag)
 
+    def payload_size(self):
+        if is_empty(self):
+            return 5
+        type = self.element_type()
+        if 0 < type < 7:
+            return 5 + len(self.data) * _fixed_sizes[type]
+        return 5 + sum(tag.payload_size() for tag in self.data)
+
+    def pack_into(self, buf, pos):
+        self.type = self.element_type()
+        _byte.pack_into(buf, pos, self.type)
+        _int.pack_into(buf, pos + 1, len(self.data))
+        pos += 5
+        if isinstance(self.data, _PrimitiveTags):
+            data = self.data.to_bytes()
+            buf[pos:pos + len(data)] = data
+            return pos + len(data)
+        for tag in self.data:
+            pos = tag.pack_into(buf, pos)
+        return pos
+
     def get_id(self):
         return 9
 
@@ -255,6 +676,8 @@ class List(Tag):
         return f"List of {tagId[self.type]}; length: {len(self.data)} entries"
 
 class Compound(Tag):
+    __slots__ = ()
+
     def __init__(self, name):
         self.name = name
         self.data = {}
@@ -273,6 +696,23 @@ class Compound(Tag):
             else:
                 break
 
+    def payload_size(self):
+        size = 1
+        for tag in self.data.values():
+            size += 1 + len(_encode_name(tag.name)) + tag.payload_size()
+        return size
+
+    def pack_into(self, buf, pos):
+        for tag in self.data.values():
+            buf[pos] = tag.get_id()
+            name = _encode_name(tag.name)
+            pos += 1
+            end = pos + len(name)
+            buf[pos:end] = name
+            pos = tag.pack_into(buf, end)
+        buf[pos] = 0  # TAG_End
+        return pos + 1
+
     def get_tag(self, name):
         return self.data[name]
 
@@ -300,17 +740,156 @@ class Compound(Tag):
         return 10
 
 
+class _Span:
+    """Position of a not yet decoded named tag: id byte, start of payload and end of payload."""
+    __slots__ = ("id", "start", "payload", "end")
+
+    def __init__(self, id, start, payload, end):
+        self.id = id
+        self.start = start
+        self.payload = payload
+        self.end = end
+
+
+class _LazyDict(dict):
+    """Children of a LazyCompound; raw spans are decoded on first access and stay decoded.
+
+    Every way of reading values out of it (dict(d), {**d}, update(d), d | other, ==) goes
+    through __getitem__, so raw spans are never handed out."""
+    __slots__ = ("buf",)
+
+    def __init__(self, buf):
+        dict.__init__(self)
+        self.buf = buf
+
+    def __iter__(self):
+        # Nadpisane, żeby dict(d) / update(d) nie kopiowały surowych wartości z pominięciem __getitem__
+        return dict.__iter__(self)
+
+    def __eq__(self, other):
+        if isinstance(other, _LazyDict):
+            other = dict(other.items())
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __or__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        result = dict(self.items())
+        result.update(other)
+        return result
+
+    def _decode(self, key, span):
+        return _lazy_decoder(span.id)(self.buf, span.payload, key)[0]
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if value.__class__ is _Span:
+            value = self._decode(key, value)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def pop(self, key, *default):
+        value = dict.pop(self, key, *default)
+        return self._decode(key, value) if value.__class__ is _Span else value
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        return key, self._decode(key, value) if value.__class__ is _Span else value
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def copy(self):
+        copy = _LazyDict(self.buf)
+        dict.update(copy, dict.items(self))
+        return copy
+
+
+def _compound_from(name, data):
+    tag = Compound(name)
+    tag.data = data
+    return tag
+
+
+class LazyCompound(Compound):
+    """Compound read with lazy=True: each child is decoded only when it is first accessed,
+    and children that were never accessed are written back as their original bytes."""
+    __slots__ = ()
+
+    def __init__(self, name, buf):
+        self.name = name
+        self.data = _LazyDict(buf)
+
+    def __reduce__(self):
+        # Bufora źródłowego nie da się serializować - kopia jest zwykłym, zdekodowanym Compoundem
+        return _compound_from, (self.name, dict(self.data.items()))
+
+    def remove(self, name):
+        # Bez dekodowania usuwanego taga
+        dict.pop(self.data, name, None)
+
+    def write(self, dataos):
+        for name, tag in dict.items(self.data):
+            if tag.__class__ is _Span:
+                dataos.write(self.data.buf[tag.start:tag.end])
+            else:
+                _write_named_tag(tag, dataos)
+        _write_named_tag(End(), dataos)
+
+    def payload_size(self):
+        size = 1
+        for tag in dict.values(self.data):
+            size += tag.end - tag.start if tag.__class__ is _Span else _named_size(tag)
+        return size
+
+    def pack_into(self, buf, pos):
+        for tag in dict.values(self.data):
+            if tag.__class__ is _Span:
+                end = pos + tag.end - tag.start
+                buf[pos:end] = self.data.buf[tag.start:tag.end]
+                pos = end
+            else:
+                pos = _pack_named(tag, buf, pos)
+        buf[pos] = 0  # TAG_End
+        return pos + 1
+
+
 class IntArray(Tag):
+    __slots__ = ()
+
     def write(self, dataos):
         dataos.write_int(len(self.data))
-        for x in self.data:
-            dataos.write_int(x)
+        dataos.write_int_array(self.data)
 
     def read(self, datais):
-        self.data = []
-        le = datais.read_int()
-        for x in range(0, le):
-            self.data.append(datais.read_int())
+        self.data = datais.read_int_array(datais.read_int())
+
+    def payload_size(self):
+        return 4 + len(self.data) * 4
+
+    def pack_into(self, buf, pos):
+        _int.pack_into(buf, pos, len(self.data))
+        pos += 4
+        end = pos + len(self.data) * 4
+        buf[pos:end] = dio.array_to_bytes('i', self.data)
+        return end
 
     def get_id(self):
         return 11
@@ -320,19 +899,622 @@ class IntArray(Tag):
 
 
 class LongArray(Tag):
+    __slots__ = ()
+
     def write(self, dataos):
         dataos.write_int(len(self.data))
-        for x in self.data:
-            dataos.write_long(x)
+        dataos.write_long_array(self.data)
 
     def read(self, datais):
-        self.data = []
-        le = datais.read_int()
-        for x in range(0, le):
-            self.data.append(datais.read_long())
+        self.data = datais.read_long_array(datais.read_int())
+
+    def payload_size(self):
+        return 4 + len(self.data) * 8
+
+    def pack_into(self, buf, pos):
+        _int.pack_into(buf, pos, len(self.data))
+        pos += 4
+        end = pos + len(self.data) * 8
+        buf[pos:end] = dio.array_to_bytes('q', self.data)
+        return end
 
     def get_id(self):
         return 12
 
     def __str__(self):
         return "[" + str(len(self.data)) + " longs]"
+
+
+# ---- Frozen tags ----
+# Constant subtrees encoded once: the encoder copies their cached payload instead of walking them.
+
+class Frozen:
+    """Base of frozen tags, see freeze. A frozen tag is also an instance of its tag class,
+    but cannot be changed: assignments and put / remove / clear raise AttributeError."""
+    __slots__ = ()
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"Frozen tag {self.name} cannot be changed")
+
+    def _immutable(self, *args):
+        raise AttributeError(f"Frozen tag {self.name} cannot be changed")
+
+    put = remove = pop = clear = read = _immutable
+
+    def write(self, dataos):
+        dataos.write(self.payload)
+
+    def payload_size(self):
+        return len(self.payload)
+
+    def pack_into(self, buf, pos):
+        end = pos + len(self.payload)
+        buf[pos:end] = self.payload
+        return end
+
+    def __reduce__(self):
+        return _frozen_from, (self.get_id(), self.name, self.payload)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _frozen_from(id, name, payload):
+    # Odtworzenie przy unpicklingu - dekodowanie zapisanego payloadu
+    tag = create_tag(id, name)
+    tag.read(dio.DataIO(dio.BufferIO(payload)))
+    return freeze(tag)
+
+
+class FrozenByte(Frozen, Byte):
+    __slots__ = ("payload",)
+
+
+class FrozenShort(Frozen, Short):
+    __slots__ = ("payload",)
+
+
+class FrozenInt(Frozen, Int):
+    __slots__ = ("payload",)
+
+
+class FrozenLong(Frozen, Long):
+    __slots__ = ("payload",)
+
+
+class FrozenFloat(Frozen, Float):
+    __slots__ = ("payload",)
+
+
+class FrozenDouble(Frozen, Double):
+    __slots__ = ("payload",)
+
+
+class FrozenByteArray(Frozen, ByteArray):
+    __slots__ = ("payload",)
+
+
+class FrozenString(Frozen, String):
+    __slots__ = ("payload",)
+
+
+class FrozenList(Frozen, List):
+    __slots__ = ("payload",)
+
+
+class FrozenCompound(Frozen, Compound):
+    __slots__ = ("payload",)
+
+
+class FrozenIntArray(Frozen, IntArray):
+    __slots__ = ("payload",)
+
+
+class FrozenLongArray(Frozen, LongArray):
+    __slots__ = ("payload",)
+
+
+# Typ tagu -> klasa zamrożonego tagu
+_frozen_classes = (None, FrozenByte, FrozenShort, FrozenInt, FrozenLong, FrozenFloat, FrozenDouble, FrozenByteArray,
+                   FrozenString, FrozenList, FrozenCompound, FrozenIntArray, FrozenLongArray)
+
+
+def freeze(tag):
+    """Return a frozen copy of a tag and its whole subtree, with its payload encoded once.
+
+    Writing a tree that contains frozen tags copies their cached bytes, so templates
+    put into many trees (see clone) are only encoded once.
+    """
+    if isinstance(tag, Frozen):
+        return tag
+    id = tag.get_id()
+    payload = bytearray(tag.payload_size())
+    tag.pack_into(payload, 0)
+    if id == 10:
+        data = MappingProxyType({name: freeze(child) for name, child in tag.data.items()})
+    elif id == 9:
+        data = tuple(freeze(element) for element in tag.data)
+    elif id == 7:
+        data = bytes(_tag_data.__get__(tag))
+    elif id == 11 or id == 12:
+        data = memoryview(array('i' if id == 11 else 'q', tag.data)).toreadonly()
+    else:
+        data = tag.data
+    frozen = object.__new__(_frozen_classes[id])
+    object.__setattr__(frozen, "name", tag.name)
+    object.__setattr__(frozen, "data", data)
+    object.__setattr__(frozen, "payload", bytes(payload))
+    if id == 9:
+        object.__setattr__(frozen, "type", tag.element_type())
+    return frozen
+
+
+def clone(tag):
+    """Copy a tag tree for building many similar trees from one template: compounds, lists
+    and arrays are copied, frozen subtrees are shared, not yet decoded children of
+    a LazyCompound stay undecoded."""
+    if isinstance(tag, Frozen):
+        return tag
+    id = tag.get_id()
+    if isinstance(tag, LazyCompound):
+        result = LazyCompound(tag.name, tag.data.buf)
+        for name, child in dict.items(tag.data):
+            dict.__setitem__(result.data, name, child if child.__class__ is _Span else clone(child))
+        return result
+    if id == 10:
+        result = Compound(tag.name)
+        result.data = {name: clone(child) for name, child in tag.data.items()}
+        return result
+    if id == 9:
+        result = List(tag.name)
+        result.type = tag.type
+        if isinstance(tag.data, _PrimitiveTags) and tag.data.tags is None:
+            result.data = _PrimitiveTags(tag.data.type, copy.copy(tag.data.values))
+        elif tag.data is not None:
+            result.data = [clone(element) for element in tag.data]
+        return result
+    if id == 7:
+        # bytes i widoki tylko do odczytu można współdzielić
+        data = _tag_data.__get__(tag)
+        return ByteArray(tag.name, data if isinstance(data, (bytes, memoryview)) else bytearray(data))
+    if id == 11 or id == 12:
+        return tag.__class__(tag.name, copy.copy(tag.data))
+    return tag.__class__(tag.name, tag.data)
+
+
+# ---- Diff ----
+
+# Rodzaje zmian zwracane przez diff
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+
+def diff(a, b):
+    """Differences between two tag trees as a list of (kind, path, old tag, new tag), kind being
+    ADDED, REMOVED or CHANGED. Paths are dotted, relative to a and b, with list indices as
+    names (e.g. "Level.Sections.3.Y"); arrays and values are compared as a whole.
+
+    Subtrees are compared by hash first and only descended into when the hashes differ.
+    Hashes are computed bottom-up: values and lists of values from their binary encoding,
+    compounds and lists of compounds or lists from the names and hashes of their children,
+    so every tag is encoded once. Not yet decoded values in lazy compounds and frozen tags
+    are hashed from their raw bytes; children of lazy compounds that have the same raw bytes
+    on both sides are not decoded at all.
+    """
+    changes = []
+    _diff("", a, b, changes, {})
+    return changes
+
+
+def _structural(id, data, pos=None):
+    # Czy hash taga liczony jest z hashy jego dzieci: compoundy i listy compoundów / list
+    if id == 10:
+        return True
+    if id != 9:
+        return False
+    if pos is not None:
+        return data[pos] in (9, 10)
+    if isinstance(data, _PrimitiveTags) or not data:
+        return False
+    return data[0].get_id() in (9, 10)
+
+
+def _value_digest(id, payload):
+    digest = hashlib.blake2b(bytes((id,)), digest_size=16)
+    digest.update(payload)
+    return digest.digest()
+
+
+def _child_digest(children, name, child, memo):
+    # Dziecko compounda; nie zdekodowane wartości hashowane z surowych bajtów
+    if child.__class__ is _Span:
+        if not _structural(child.id, children.buf, child.payload):
+            entry = memo.get(id(child))
+            if entry is None:
+                payload = children.buf[child.payload:child.end]
+                if child.id == 9 and _int.unpack_from(payload, 1)[0] == 0:
+                    # Pusta lista jest zapisywana jako lista tagów End
+                    payload = bytes(5)
+                entry = memo[id(child)] = (child, _value_digest(child.id, payload))
+            return entry[1]
+        child = children[name]
+    return _digest(child, memo)
+
+
+def _digest(tag, memo):
+    # memo: id -> (tag, hash), tag trzymany, żeby id nie zostało użyte ponownie
+    entry = memo.get(id(tag))
+    if entry is not None:
+        return entry[1]
+    type = tag.get_id()
+    if not _structural(type, tag.data):
+        if isinstance(tag, Frozen):
+            payload = tag.payload
+        else:
+            payload = bytearray(tag.payload_size())
+            tag.pack_into(payload, 0)
+        value = _value_digest(type, payload)
+    elif type == 10:
+        digest = hashlib.blake2b(b"\x0a", digest_size=16)
+        children = tag.data
+        items = dict.items(children) if isinstance(children, _LazyDict) else children.items()
+        for name, child in sorted(items, key=lambda item: item[0]):
+            encoded = dio.encode_utf(name)
+            digest.update(_ushort.pack(len(encoded)))
+            digest.update(encoded)
+            digest.update(_child_digest(children, name, child, memo))
+        value = digest.digest()
+    else:
+        digest = hashlib.blake2b(b"\x09", digest_size=16)
+        digest.update(bytes((tag.data[0].get_id(),)))
+        digest.update(_int.pack(len(tag.data)))
+        for element in tag.data:
+            digest.update(_digest(element, memo))
+        value = digest.digest()
+    memo[id(tag)] = (tag, value)
+    return value
+
+
+def _path(path, name):
+    return f"{path}.{name}" if path else str(name)
+
+
+def _diff(path, a, b, changes, memo):
+    if a is b:
+        return
+    id = a.get_id()
+    if id != b.get_id():
+        changes.append((CHANGED, path, a, b))
+        return
+    if id == 10:
+        # Compoundy porównywane dziecko po dziecku - bez liczenia hashy całych drzew
+        a_children = dict(dict.items(a.data)) if isinstance(a.data, _LazyDict) else a.data
+        b_children = dict(dict.items(b.data)) if isinstance(b.data, _LazyDict) else b.data
+        for name, child in a_children.items():
+            other = b_children.get(name)
+            if other is None:
+                changes.append((REMOVED, _path(path, name), a.data[name], None))
+            elif child.__class__ is _Span and other.__class__ is _Span \
+                    and bytes(a.data.buf[child.start:child.end]) == bytes(b.data.buf[other.start:other.end]):
+                continue
+            elif _child_digest(a.data, name, child, memo) != _child_digest(b.data, name, other, memo):
+                _diff(_path(path, name), a.data[name], b.data[name], changes, memo)
+        for name in b_children:
+            if name not in a_children:
+                changes.append((ADDED, _path(path, name), None, b.data[name]))
+    elif _digest(a, memo) == _digest(b, memo):
+        return
+    elif id == 9:
+        a_data = a.data or ()
+        b_data = b.data or ()
+        for i in range(0, min(len(a_data), len(b_data))):
+            _diff(_path(path, i), a_data[i], b_data[i], changes, memo)
+        for i in range(len(b_data), len(a_data)):
+            changes.append((REMOVED, _path(path, i), a_data[i], None))
+        for i in range(len(a_data), len(b_data)):
+            changes.append((ADDED, _path(path, i), None, b_data[i]))
+    else:
+        changes.append((CHANGED, path, a, b))
+
+
+# ---- Buffer decoder ----
+# Walks a bytes-like object with an integer cursor instead of going through DataIO,
+# every decoder returns (tag, new_position).
+
+_byte = Struct('>b')
+_short = Struct('>h')
+_ushort = Struct('>H')
+_int = Struct('>i')
+_long = Struct('>q')
+_float = Struct('>f')
+_double = Struct('>d')
+
+
+def _decode_utf(buf, pos):
+    length = _ushort.unpack_from(buf, pos)[0]
+    pos += 2
+    return dio.decode_utf(buf[pos:pos + length]), pos + length
+
+
+# Nazwy tagów wg ich zakodowanej postaci - te same klucze ("Level", "Sections", "Y"...)
+# powtarzają się w każdym chunku, więc wszystkie wystąpienia dzielą jeden obiekt str
+_decoded_names = {}
+_decoded_names_limit = 4096
+
+
+def _decode_name(buf, pos):
+    end = pos + 2 + _ushort.unpack_from(buf, pos)[0]
+    raw = bytes(buf[pos + 2:end])
+    name = _decoded_names.get(raw)
+    if name is None:
+        name = sys.intern(dio.decode_utf(raw))
+        if len(_decoded_names) < _decoded_names_limit:
+            _decoded_names[raw] = name
+    return name, end
+
+
+def _decode_byte(buf, pos, name):
+    return Byte(name, _byte.unpack_from(buf, pos)[0]), pos + 1
+
+
+def _decode_short(buf, pos, name):
+    return Short(name, _short.unpack_from(buf, pos)[0]), pos + 2
+
+
+def _decode_int(buf, pos, name):
+    return Int(name, _int.unpack_from(buf, pos)[0]), pos + 4
+
+
+def _decode_long(buf, pos, name):
+    return Long(name, _long.unpack_from(buf, pos)[0]), pos + 8
+
+
+def _decode_float(buf, pos, name):
+    return Float(name, _float.unpack_from(buf, pos)[0]), pos + 4
+
+
+def _decode_double(buf, pos, name):
+    return Double(name, _double.unpack_from(buf, pos)[0]), pos + 8
+
+
+def _decode_byte_array(buf, pos, name):
+    length = _int.unpack_from(buf, pos)[0]
+    pos += 4
+    if isinstance(buf, memoryview) and buf.readonly:
+        # Bez kopiowania - widok na bufor źródłowy
+        return ByteArray(name, buf[pos:pos + length]), pos + length
+    return ByteArray(name, bytearray(buf[pos:pos + length])), pos + length
+
+
+def _decode_string(buf, pos, name):
+    data, pos = _decode_utf(buf, pos)
+    return String(name, data), pos
+
+
+def _decode_list(buf, pos, name):
+    tag = List(name)
+    tag.type = type = _byte.unpack_from(buf, pos)[0]
+    size = _int.unpack_from(buf, pos + 1)[0]
+    pos += 5
+    if type in _list_typecodes and size > 0:
+        end = pos + size * _fixed_sizes[type]
+        tag.data = _PrimitiveTags.from_bytes(type, buf[pos:end])
+        return tag, end
+    if size > 0:
+        decode = _decoder(type)
+        data = tag.data
+        for x in range(0, size):
+            element, pos = decode(buf, pos, None)
+            data.append(element)
+    return tag, pos
+
+
+def _decode_compound(buf, pos, name):
+    tag = Compound(name)
+    data = tag.data
+    while True:
+        id = buf[pos]
+        if id == 0:  # TAG_End
+            return tag, pos + 1
+        key, pos = _decode_name(buf, pos + 1)
+        data[key], pos = _decoder(id)(buf, pos, key)
+
+
+def _decode_int_array(buf, pos, name):
+    length = _int.unpack_from(buf, pos)[0]
+    pos += 4
+    end = pos + length * 4
+    return IntArray(name, dio.array_from_bytes('i', buf[pos:end])), end
+
+
+def _decode_long_array(buf, pos, name):
+    length = _int.unpack_from(buf, pos)[0]
+    pos += 4
+    end = pos + length * 8
+    return LongArray(name, dio.array_from_bytes('q', buf[pos:end])), end
+
+
+_tag_classes = (End, Byte, Short, Int, Long, Float, Double, ByteArray, String, List, Compound, IntArray, LongArray)
+
+_decoders = (None, _decode_byte, _decode_short, _decode_int, _decode_long, _decode_float, _decode_double,
+             _decode_byte_array, _decode_string, _decode_list, _decode_compound, _decode_int_array,
+             _decode_long_array)
+
+
+def _decoder(id):
+    if 0 < id < len(_decoders):
+        return _decoders[id]
+    raise TypeError("Unknown tag ID")
+
+
+def _decode_named_tag(buf, pos, lazy=False):
+    id = _byte.unpack_from(buf, pos)[0]
+    if id == 0:
+        return End(), pos + 1
+    name, pos = _decode_name(buf, pos + 1)
+    return (_lazy_decoder if lazy else _decoder)(id)(buf, pos, name)
+
+
+# ---- Buffer encoder ----
+# Every tag reports its payload_size() first, so the whole tree is packed into one
+# preallocated bytearray with pack_into(buf, pos), which returns the new position.
+
+def _utf_size(string):
+    # NUL jest zapisywany jako dwa bajty (C0 80), patrz encode_utf
+    if string.isascii() and "\0" not in string:
+        length = len(string)
+    else:
+        length = len(dio.encode_utf(string))
+    if length > 65535:
+        raise IOError(f"Encoded string too long: {length} bytes")
+    return 2 + length
+
+
+def _pack_utf(string, buf, pos):
+    data = dio.encode_utf(string)
+    length = len(data)
+    _ushort.pack_into(buf, pos, length)
+    pos += 2
+    buf[pos:pos + length] = data
+    return pos + length
+
+
+# Zakodowane nazwy tagów (z długością), nazwy kluczy w chunkach ciągle się powtarzają
+_encoded_names = {}
+_encoded_names_limit = 4096
+
+
+def _encode_name(name):
+    data = _encoded_names.get(name)
+    if data is None:
+        encoded = dio.encode_utf(name)
+        if len(encoded) > 65535:
+            raise IOError(f"Encoded string too long: {len(encoded)} bytes")
+        data = _ushort.pack(len(encoded)) + encoded
+        if len(_encoded_names) < _encoded_names_limit:
+            _encoded_names[name] = data
+    return data
+
+
+def _named_size(tag):
+    if tag.get_id() == 0:
+        return 1
+    return 1 + len(_encode_name(tag.name)) + tag.payload_size()
+
+
+def _pack_named(tag, buf, pos):
+    id = tag.get_id()
+    buf[pos] = id
+    if id == 0:
+        return pos + 1
+    name = _encode_name(tag.name)
+    pos += 1
+    end = pos + len(name)
+    buf[pos:end] = name
+    return tag.pack_into(buf, end)
+
+
+# ---- Lazy decoding ----
+# Compounds only record where each child lies in the buffer, skipping over the payload
+# using its length prefixes; lists are decoded, but compounds inside them are lazy too.
+
+_fixed_sizes = (0, 1, 2, 4, 8, 4, 8)
+
+
+def _skip_payload(id, buf, pos):
+    if 0 < id < 7:
+        return pos + _fixed_sizes[id]
+    elif id == 7:
+        return pos + 4 + _int.unpack_from(buf, pos)[0]
+    elif id == 8:
+        return pos + 2 + _ushort.unpack_from(buf, pos)[0]
+    elif id == 9:
+        type = _byte.unpack_from(buf, pos)[0]
+        size = _int.unpack_from(buf, pos + 1)[0]
+        pos += 5
+        if size <= 0:
+            return pos
+        if 0 < type < 7:
+            return pos + size * _fixed_sizes[type]
+        for x in range(0, size):
+            pos = _skip_payload(type, buf, pos)
+        return pos
+    elif id == 10:
+        while True:
+            id = buf[pos]
+            if id == 0:
+                return pos + 1
+            pos = _skip_payload(id, buf, pos + 3 + _ushort.unpack_from(buf, pos + 1)[0])
+    elif id == 11:
+        return pos + 4 + _int.unpack_from(buf, pos)[0] * 4
+    elif id == 12:
+        return pos + 4 + _int.unpack_from(buf, pos)[0] * 8
+    raise TypeError("Unknown tag ID")
+
+
+def _scan_compound(buf, pos, name):
+    tag = LazyCompound(name, buf)
+    data = tag.data
+    while True:
+        id = buf[pos]
+        if id == 0:  # TAG_End
+            return tag, pos + 1
+        start = pos
+        key, pos = _decode_name(buf, pos + 1)
+        end = _skip_payload(id, buf, pos)
+        dict.__setitem__(data, key, _Span(id, start, pos, end))
+        pos = end
+
+
+def _scan_list(buf, pos, name):
+    tag = List(name)
+    tag.type = type = _byte.unpack_from(buf, pos)[0]
+    size = _int.unpack_from(buf, pos + 1)[0]
+    pos += 5
+    if type in _list_typecodes and size > 0:
+        end = pos + size * _fixed_sizes[type]
+        tag.data = _PrimitiveTags.from_bytes(type, buf[pos:end])
+        return tag, end
+    if size > 0:
+        decode = _lazy_decoder(type)
+        data = tag.data
+        for x in range(0, size):
+            element, pos = decode(buf, pos, None)
+            data.append(element)
+    return tag, pos
+
+
+def _extract_compound(buf, pos, wanted, result, total, lazy):
+    while len(result) < total:
+        id = buf[pos]
+        if id == 0:  # TAG_End
+            return pos + 1
+        key, pos = _decode_name(buf, pos + 1)
+        entry = wanted.get(key)
+        if entry is None:
+            pos = _skip_payload(id, buf, pos)
+            continue
+        path, children = entry
+        if path is not None:
+            if children and id == 10:
+                _extract_compound(buf, pos, children, result, total, lazy)
+            tag, pos = (_lazy_decoder(id) if lazy else _decoder(id))(buf, pos, key)
+            result[path] = tag if id == 10 else tag.data
+        elif id == 10:
+            pos = _extract_compound(buf, pos, children, result, total, lazy)
+        else:
+            pos = _skip_payload(id, buf, pos)
+    return pos
+
+
+_lazy_decoders = _decoders[:9] + (_scan_list, _scan_compound) + _decoders[11:]
+
+
+def _lazy_decoder(id):
+    if 0 < id < len(_lazy_decoders):
+        return _lazy_decoders[id]
+    raise TypeError("Unknown tag ID")
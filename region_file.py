@@ -36,37 +36,170 @@ in Java and published by Mojang along with the Anvil Converter tool.
  A version of 2 represents a deflated (zlib compressed) NBT file. The deflated
  data is the chunk length - 1.
 
+ Newer versions of the game also use version 3 (uncompressed NBT) and version 4
+ (LZ4, in the block stream format of lz4-java). If bit 128 of the version is set,
+ the chunk is stored in a separate "c.x.z.mcc" file next to the region file
+ (x, z - chunk coordinates), compressed as given by the remaining bits.
+
  */
 
 """
-import gzip, zlib, time, os
+import gzip, zlib, time, os, mmap, re
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ThreadPoolExecutor, wait
+from struct import Struct
 from java_data_io import *
+import nbt_lib
+
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 __author__ = "Karol"
 
 # Stałe
 version_gzip = 1
 version_zlib = 2
+version_none = 3
+version_lz4 = 4
+external_flag = 128
 sector_bytes = 4096  # 4kB
 sector_ints = sector_bytes // 4  # 1 int (32 bit) = 4 byte (8 bit)
 chunk_header_size = 5
 empty_sector = bytearray(sector_bytes)
 max_chunk_size = 1048576 // sector_bytes
+region_name = re.compile(r"r\.(-?\d+)\.(-?\d+)\.mc[ar]$")
+external_name = re.compile(r"c\.(-?\d+)\.(-?\d+)\.mcc$")
+length_struct = Struct(">i")
+header_entry_struct = Struct(">I")
+lz4_magic = b"LZ4Block"
+lz4_header_struct = Struct("<iii")  # długość skompresowana, długość oryginalna, suma kontrolna
+lz4_block_size = 1 << 16
+lz4_seed = 0x9747b28c
+lz4_word_struct = Struct("<I")
 dbg = lambda self, x: print(f"[REGION]|['{self.fileName}']|[{'EXCEPTION' if isinstance(x, Exception) else 'INFO'}]: {x}")
 
 
+class SectorAllocator:
+    """Free sectors of a region file kept as sorted runs of free sectors.
+
+    Runs are also indexed by length (lengths of max_chunk_size and more share the last
+    bucket), so finding a run for a chunk looks at no more than max_chunk_size buckets
+    and updates are a bisect on the run list, instead of a scan over every sector.
+    first-fit picks the lowest run that is long enough, best-fit the shortest one.
+    """
+
+    def __init__(self, size, best_fit=False):
+        self.size = size
+        self.bestFit = best_fit
+        self.starts = []
+        self.lengths = {}
+        self.buckets = [[] for x in range(0, max_chunk_size + 1)]
+
+    @staticmethod
+    def from_free_map(sector_free, best_fit=False):
+        allocator = SectorAllocator(len(sector_free), best_fit)
+        run_start = -1
+        for i, free in enumerate(sector_free):
+            if free and run_start == -1:
+                run_start = i
+            elif not free and run_start != -1:
+                allocator.__add_run(run_start, i - run_start)
+                run_start = -1
+        if run_start != -1:
+            allocator.__add_run(run_start, len(sector_free) - run_start)
+        return allocator
+
+    def __add_run(self, start, length):
+        insort(self.starts, start)
+        self.lengths[start] = length
+        insort(self.buckets[min(length, max_chunk_size)], start)
+
+    def __remove_run(self, index):
+        start = self.starts.pop(index)
+        bucket = self.buckets[min(self.lengths.pop(start), max_chunk_size)]
+        del bucket[bisect_left(bucket, start)]
+        return start
+
+    def is_free(self, sector):
+        i = bisect_right(self.starts, sector) - 1
+        return i >= 0 and sector < self.starts[i] + self.lengths[self.starts[i]]
+
+    def free_sectors(self):
+        return sum(self.lengths.values())
+
+    def allocate(self, count):
+        """Take a run of count sectors and return its first sector, or None if no free run fits."""
+        start = None
+        for bucket in self.buckets[count:]:
+            if bucket and (start is None or bucket[0] < start):
+                start = bucket[0]
+                if self.bestFit:
+                    break
+        if start is None:
+            return None
+        length = self.lengths[start]
+        self.__remove_run(bisect_left(self.starts, start))
+        if length > count:
+            self.__add_run(start + count, length - count)
+        return start
+
+    def extend(self, count):
+        """Grow the file by count sectors, all in use, and return the first of them."""
+        start = self.size
+        self.size += count
+        return start
+
+    def free(self, start, count):
+        # Sektory 0 i 1 to nagłówek; zakres może nachodzić na już wolne sektory
+        end = min(start + count, self.size)
+        start = max(start, 2)
+        if start >= end:
+            return
+        i = bisect_right(self.starts, start) - 1
+        if i >= 0 and self.starts[i] + self.lengths[self.starts[i]] >= start:
+            end = max(end, self.starts[i] + self.lengths[self.starts[i]])
+            start = self.__remove_run(i)
+        else:
+            i += 1
+        while i < len(self.starts) and self.starts[i] <= end:
+            end = max(end, self.starts[i] + self.lengths[self.starts[i]])
+            self.__remove_run(i)
+        self.__add_run(start, end - start)
+
+
 class RegionFile:
 
-    def __init__(self, file_name):
+    def __init__(self, file_name, read_only=False, write_through=False, best_fit=False, workers=None,
+                 compression=version_zlib, compression_level=-1):
         self.fileName = file_name
-        self.offsets = [0] * sector_ints
-        self.chunkTimestamps = [0] * sector_ints
+        self.offsets = array('I', bytes(sector_bytes))
+        self.chunkTimestamps = array('I', bytes(sector_bytes))
         self.sizeDelta = 0
         self.lastModified = 0
+        self.map = None
+        # write_through=False: zmiany nagłówka trzymane w pamięci i zapisywane w flush()/close()
+        self.writeThrough = write_through
+        self.headerDirty = False
+        self.bestFit = best_fit
+        # Pula wątków do (de)kompresji w read_chunks/write_chunks, tworzona przy pierwszym użyciu
+        self.workers = workers
+        self.executor = None
+        # Kompresja nowo zapisywanych chunków, poziom -1 - domyślny dla danej metody
+        self.compression = compression
+        self.compressionLevel = compression_level
 
         #dbg(self, "LOAD ")
 
         try:
+            if read_only:
+                self.__map_file()
+                return
             if os.path.exists(file_name):
                 self.lastModified = os.path.getmtime(file_name)
             else:
@@ -79,8 +212,7 @@ class RegionFile:
             if self.file.length() < sector_bytes:
                 # Plik jest pusty
                 # Zainicjuj dwa pierwsze sektory na tablice: offset, timestamp
-                for x in range(0, sector_ints * 2):
-                    self.file.write_int(0)
+                self.file.write(bytes(sector_bytes * 2))
                 self.sizeDelta += sector_bytes * 2
 
             if self.file.length() & 0xfff != 0:
@@ -96,23 +228,38 @@ class RegionFile:
             # Oblicz, z ilu sektorów aktualnie składa się plik
             n_sectors = self.file.length() // sector_bytes
             # dbg(self, f"SECTORS {n_sectors}")
-            self.sectorFree = [True] * n_sectors
-            self.sectorFree[0] = False
-            self.sectorFree[1] = False
             self.file.seek(0)
-            for x in range(0, sector_ints):
-                offset = self.file.read_int()
-                self.offsets[x] = offset
-
-                if offset != 0 and (offset >> 8) + (offset & 0xFF) <= sector_ints:
-                    for sectorNum in range(0, offset & 0xFF):
-                        self.sectorFree[(offset >> 8) + sectorNum] = False
-            for x in range(0, sector_ints):
-                self.chunkTimestamps[x] = self.file.read_int()
+            self.__read_header(self.file.read(sector_bytes * 2), [True] * n_sectors)
 
         except BaseException as e:
             print(e)
 
+    def __map_file(self):
+        # Tylko do odczytu: cały plik mapowany w pamięć
+        self.lastModified = os.path.getmtime(self.fileName)
+        self.file = open(self.fileName, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        sector_free = [True] * (size // sector_bytes)
+        if size < sector_bytes * 2:
+            dbg(self, "MAP file too short")
+            self.sectors = SectorAllocator.from_free_map(sector_free)
+            self.map = b""
+            return
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__read_header(self.map[0:sector_bytes * 2], sector_free)
+
+    def __read_header(self, data, sector_free):
+        # Obie tablice nagłówka (offset, timestamp) wczytane naraz
+        self.offsets = array_from_bytes('I', data[0:sector_bytes])
+        self.chunkTimestamps = array_from_bytes('I', data[sector_bytes:sector_bytes * 2])
+        sector_free[0] = False
+        sector_free[1] = False
+        for offset in self.offsets:
+            if offset != 0 and (offset >> 8) + (offset & 0xFF) <= len(sector_free):
+                for sectorNum in range(0, offset & 0xFF):
+                    sector_free[(offset >> 8) + sectorNum] = False
+        self.sectors = SectorAllocator.from_free_map(sector_free, self.bestFit)
+
     def last_modified(self):
         return self.lastModified
 
@@ -125,8 +272,14 @@ class RegionFile:
 
     def set_offset(self, x, z, offset):
         self.offsets[x + z * 32] = offset
-        self.file.seek((x + z * 32) * 4)
-        self.file.write_int(offset)
+        self.__write_header_entry((x + z * 32) * 4, offset)
+
+    def __write_header_entry(self, position, value):
+        if self.writeThrough:
+            self.file.seek(position)
+            self.file.write(header_entry_struct.pack(value))
+        else:
+            self.headerDirty = True
 
     def has_chunk(self, x, z):
         if self.out_of_bounds(x, z):
@@ -135,16 +288,60 @@ class RegionFile:
 
     def set_timestamp(self, x, z, value):
         self.chunkTimestamps[x + z * 32] = value
-        self.file.seek(sector_bytes + (x + z * 32) * 4)
-        self.file.write_int(value)
+        self.__write_header_entry(sector_bytes + (x + z * 32) * 4, value)
 
     def get_timestamp(self, x, z):
         return self.chunkTimestamps[x + z * 32]
 
+    def flush(self):
+        if self.map is not None:
+            return
+        if self.headerDirty:
+            self.file.seek(0)
+            self.file.write(array_to_bytes('I', self.offsets) + array_to_bytes('I', self.chunkTimestamps))
+            self.headerDirty = False
+        self.file.flush()
+
     def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if isinstance(self.map, mmap.mmap):
+            try:
+                self.map.close()
+            except BufferError:
+                # Widok na dane chunku jeszcze żyje (np. w śledzeniu wyjątku) - mapę zamknie GC
+                dbg(self, "CLOSE map still in use")
+        else:
+            self.flush()
         self.file.close()
 
     def read_chunk(self, x, z):
+        chunk = self.read_chunk_versioned(x, z)
+        return None if chunk is None else chunk[1]
+
+    def read_chunk_versioned(self, x, z):
+        """Return (compression version, DataIO) of a chunk, reading its payload once; None if it cannot be read."""
+        payload = self.__read_payload(x, z)
+        if payload is None:
+            return None
+        try:
+            data = self.__decompress(x, z, *payload)
+        finally:
+            _release(payload[1])
+        return None if data is None else (payload[0], data)
+
+    def read_chunk_raw(self, x, z):
+        """Return (compression version, compressed payload, timestamp) of a chunk, without decompressing it."""
+        payload = self.__read_payload(x, z)
+        if payload is None:
+            return None
+        try:
+            return payload[0], bytes(payload[1]), self.get_timestamp(x, z)
+        finally:
+            _release(payload[1])
+
+    def __read_payload(self, x, z):
         if self.out_of_bounds(x, z):
             dbg(self, f"READ {x, z} out of bounds")
             return None
@@ -155,85 +352,119 @@ class RegionFile:
 
             sector_num = offset >> 8
             num_sectors = offset & 0xFF
-            if sector_num + num_sectors > len(self.sectorFree):
+            if sector_num + num_sectors > self.sectors.size:
                 dbg(self, f"READ {x, z} invalid sector")
                 return None
-            self.file.seek(sector_num * sector_bytes)
-            length = self.file.read_int()
+            start = sector_num * sector_bytes
+            if self.map is not None:
+                length = length_struct.unpack_from(self.map, start)[0]
+            else:
+                self.file.seek(start)
+                length = self.file.read_int()
             if length > sector_bytes * num_sectors:
                 dbg(self, f"READ {x, z} invalid length: {length} > {sector_bytes * num_sectors}")
                 return None
-            version = self.file.read_byte()
-            raw = self.file.read(length - 1)
-            if version == version_gzip:
-                # dbg(self, f"READ {x, z} GZIP")
-                return DataIO(ByteArrayIO(gzip.decompress(raw)))
-            elif version == version_zlib:
-                # dbg(self, f"READ {x, z} ZLIB")
-                return DataIO(ByteArrayIO(zlib.decompress(raw)))
-            dbg(self, f"READ {x, z} unknown version '{version}'")
+            if self.map is not None:
+                # Bez kopiowania - widok na zmapowany plik
+                version = self.map[start + 4]
+                raw = memoryview(self.map)[start + 5:start + 4 + length]
+            else:
+                version = self.file.read_unsigned_byte()
+                raw = self.file.read(length - 1)
+            if version & external_flag:
+                path = self.__external_path(x, z)
+                if path is None:
+                    dbg(self, f"READ {x, z} external chunk of unnamed region")
+                    return None
+                with open(path, "rb") as f:
+                    return version & ~external_flag, f.read()
+            return version, raw
         except IOError as e:
             dbg(self, f"READ {x, z} exception")
             dbg(self, e)
         return None
 
-    def __write(self, sector_num, data, length):
+    def __external_path(self, x, z):
+        region = region_coords(self.fileName)
+        if region is None:
+            return None
+        return os.path.join(os.path.dirname(self.fileName), f"c.{region[0] * 32 + x}.{region[1] * 32 + z}.mcc")
+
+    def __decompress(self, x, z, version, raw):
+        if version == version_gzip:
+            # dbg(self, f"READ {x, z} GZIP")
+            return DataIO(BufferIO(gzip.decompress(raw)))
+        elif version == version_zlib:
+            # dbg(self, f"READ {x, z} ZLIB")
+            return DataIO(BufferIO(zlib.decompress(raw)))
+        elif version == version_none:
+            return DataIO(BufferIO(bytes(raw)))
+        elif version == version_lz4:
+            if lz4 is None:
+                dbg(self, f"READ {x, z} LZ4 needs the lz4 module")
+                return None
+            return DataIO(BufferIO(lz4_decompress(raw)))
+        dbg(self, f"READ {x, z} unknown version '{version}'")
+        return None
+
+    def __stored_externally(self, sector_num, num_sectors):
+        # Czy wpis w regionie wskazuje na plik .mcc (bit external_flag wersji); taki wpis
+        # ma zawsze jeden sektor, więc dłuższych nie trzeba czytać
+        if num_sectors != 1 or sector_num + num_sectors > self.sectors.size:
+            return False
+        self.file.seek(sector_num * sector_bytes + 4)
+        return self.file.read_unsigned_byte() & external_flag != 0
+
+    def __write(self, sector_num, data, length, version):
         self.file.seek(sector_num * sector_bytes)
         self.file.write_int(length + 1)
-        self.file.write_byte(version_zlib)
+        self.file.write_unsigned_byte(version)
         self.file.write(data)
 
-    def write(self, x, z, data, length):
+    def write(self, x, z, data, length, version=version_zlib, timestamp=None):
+        if self.map is not None:
+            dbg(self, f"SAVE {x, z} read only")
+            return
         try:
             offset = self.get_offset(x, z)
             sector_num = offset >> 8
             alloc_sectors = offset & 0xFF
             sectors_needed = (length + chunk_header_size) // sector_bytes + 1
             if sectors_needed >= max_chunk_size:
-                dbg(self, f"SAVE {x, z} oversize")
-                return
+                external = self.__external_path(x, z)
+                if external is None:
+                    dbg(self, f"SAVE {x, z} oversize")
+                    return
+                # Za duży na plik regionu - dane w osobnym pliku .mcc, w regionie tylko wersja
+                with open(external, "wb") as f:
+                    f.write(data)
+                data, length, version = b"", 0, version | external_flag
+                sectors_needed = 1
+            elif sector_num != 0 and self.__stored_externally(sector_num, alloc_sectors):
+                try:
+                    os.remove(self.__external_path(x, z))
+                except (FileNotFoundError, TypeError):
+                    pass
 
             if sector_num != 0 and alloc_sectors == sectors_needed:
                 # dbg(self, f"SAVE {x, z} rewrite")
-                self.__write(sector_num, data, length)
+                self.__write(sector_num, data, length, version)
             else:
-                self.sectorFree[sector_num:sector_num + alloc_sectors] = [True] * alloc_sectors
-                run_start = -1
-                try:
-                    run_start = self.sectorFree.index(True)
-                except ValueError:
-                    pass
-                run_length = 0
-                if run_start != -1:
-                    for i in range(run_start, len(self.sectorFree)):
-                        if run_length != 0:
-                            if self.sectorFree[i]:
-                                run_length += 1
-                            else:
-                                run_length = 0
-                        elif self.sectorFree[i]:
-                            run_start = i
-                            run_length = 1
-                        if run_length >= sectors_needed:
-                            break
-                if run_length >= sectors_needed:
+                self.sectors.free(sector_num, alloc_sectors)
+                sector_num = self.sectors.allocate(sectors_needed)
+                if sector_num is not None:
                     # dbg(self, f"SAVE {x, z} rewrite")
-                    sector_num = run_start
                     self.set_offset(x, z, (sector_num << 8) | sectors_needed)
-                    for i in range(0, sectors_needed):
-                        self.sectorFree[sector_num + i] = False
-                    self.__write(sector_num, data, length)
+                    self.__write(sector_num, data, length, version)
                 else:
                     # dbg(self, f"SAVE {x, z} allocate")
                     self.file.seek(self.file.length())
-                    sector_num = len(self.sectorFree)
-                    for i in range(0, sectors_needed):
-                        self.file.write(empty_sector)
-                        self.sectorFree.append(False)
+                    sector_num = self.sectors.extend(sectors_needed)
+                    self.file.write(empty_sector * sectors_needed)
                     self.sizeDelta += sector_bytes * sectors_needed
-                    self.__write(sector_num, data, length)
+                    self.__write(sector_num, data, length, version)
                     self.set_offset(x, z, (sector_num << 8) | sectors_needed)
-            self.set_timestamp(x, z, time.time_ns() // 1000000000)
+            self.set_timestamp(x, z, time.time_ns() // 1000000000 if timestamp is None else timestamp)
         except IOError as e:
             dbg(self, f"SAVE {x, z} exception")
             dbg(self, e)
@@ -247,10 +478,279 @@ class RegionFile:
             self.z = z
 
         def close(self):
-            self.bytearr = zlib.compress(self.bytearr)
-            self.region.write(self.x, self.z, self.bytearr, len(self.bytearr))
+            self.bytearr = compress(self.bytearr, self.region.compression, self.region.compressionLevel)
+            self.region.write(self.x, self.z, self.bytearr, len(self.bytearr), self.region.compression)
 
     def write_chunk(self, x, z):
         if self.out_of_bounds(x, z):
             return None
         return DataIO(self.RegionBuffer(self, x, z))
+
+    def __executor(self, executor):
+        if executor is not None:
+            return executor
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.workers)
+        return self.executor
+
+    def read_chunks(self, coords, executor=None):
+        """Read many chunks at once: payloads are read serially in file order and decompressed
+        in a thread pool (zlib releases the GIL). Returns {(x, z): DataIO or None}."""
+        coords = list(coords)
+        payloads = {}
+        for x, z in sorted(coords, key=lambda c: 0 if self.out_of_bounds(*c) else self.get_offset(*c)):
+            payloads[(x, z)] = self.__read_payload(x, z)
+        pool = self.__executor(executor)
+        futures = {}
+        try:
+            for c, p in payloads.items():
+                if p is not None:
+                    futures[c] = pool.submit(self.__decompress, c[0], c[1], *p)
+            return {c: futures[c].result() if c in futures else None for c in coords}
+        finally:
+            wait(futures.values())
+            for p in payloads.values():
+                if p is not None:
+                    _release(p[1])
+
+    def write_chunks(self, chunks, executor=None):
+        """Write many chunks at once from {(x, z): root Compound or uncompressed NBT bytes}.
+        Compression runs in a thread pool, sectors are allocated and written serially in file order."""
+        pool = self.__executor(executor)
+        futures = {c: pool.submit(_compress_chunk, value, self.compression, self.compressionLevel)
+                   for c, value in chunks.items() if not self.out_of_bounds(*c)}
+        for x, z in sorted(futures, key=lambda c: self.get_offset(*c)):
+            data = futures[(x, z)].result()
+            self.write(x, z, data, len(data), self.compression)
+
+    def delete_chunk(self, x, z):
+        """Remove a chunk: its header entries are zeroed and its sectors become free."""
+        if self.out_of_bounds(x, z) or self.map is not None:
+            return
+        offset = self.get_offset(x, z)
+        if offset == 0:
+            return
+        if self.__stored_externally(offset >> 8, offset & 0xFF):
+            try:
+                os.remove(self.__external_path(x, z))
+            except (FileNotFoundError, TypeError):
+                pass
+        self.sectors.free(offset >> 8, offset & 0xFF)
+        self.set_offset(x, z, 0)
+        self.set_timestamp(x, z, 0)
+
+    def write_chunk_raw(self, x, z, version, payload, timestamp=None):
+        """Store an already compressed chunk payload, e.g. one returned by read_chunk_raw."""
+        if self.out_of_bounds(x, z):
+            return
+        self.write(x, z, payload, len(payload), version, timestamp)
+
+
+def _release(raw):
+    # Zwolnienie widoku na zmapowany plik, żeby close() mogło zamknąć mapę
+    if isinstance(raw, memoryview):
+        raw.release()
+
+
+def _compress_chunk(value, version, level):
+    if isinstance(value, nbt_lib.Tag):
+        value = nbt_lib.write_bytes(value)
+    return compress(value, version, level)
+
+
+def compress(data, version=version_zlib, level=-1):
+    """Compress chunk data with the given chunk version; level -1 is the method's default."""
+    if version == version_zlib:
+        return zlib.compress(data, level)
+    elif version == version_gzip:
+        return gzip.compress(data, 9 if level < 0 else level)
+    elif version == version_none:
+        return bytes(data)
+    elif version == version_lz4:
+        if lz4 is None:
+            raise IOError("LZ4 compression needs the lz4 module")
+        return lz4_compress(data, level)
+    raise IOError(f"Unknown chunk version '{version}'")
+
+
+# LZ4 w formacie strumienia blokowego lz4-java (LZ4BlockOutputStream), jak zapisuje go gra:
+# "LZ4Block", token (metoda | poziom), długość skompresowana, długość oryginalna i suma
+# kontrolna xxHash32 (little-endian), dane; strumień kończy pusty blok.
+
+def lz4_decompress(raw):
+    out = bytearray()
+    pos = 0
+    while pos < len(raw):
+        if raw[pos:pos + 8] != lz4_magic:
+            raise IOError("Invalid LZ4 block")
+        token = raw[pos + 8]
+        compressed_length, length, checksum = lz4_header_struct.unpack_from(raw, pos + 9)
+        pos += 21
+        if length == 0:
+            break
+        block = raw[pos:pos + compressed_length]
+        pos += compressed_length
+        if token & 0xF0 == 0x10:
+            out += block
+        else:
+            out += lz4.block.decompress(block, uncompressed_size=length)
+    return bytes(out)
+
+
+def lz4_compress(data, level=-1):
+    # Poziom w tokenie: log2(rozmiar bloku) - 10
+    level_bits = lz4_block_size.bit_length() - 11
+    out = bytearray()
+    for pos in range(0, len(data), lz4_block_size):
+        block = bytes(data[pos:pos + lz4_block_size])
+        if level > 0:
+            compressed = lz4.block.compress(block, mode="high_compression", compression=level, store_size=False)
+        else:
+            compressed = lz4.block.compress(block, store_size=False)
+        method = 0x20
+        if len(compressed) >= len(block):
+            compressed, method = block, 0x10
+        out += lz4_magic
+        out.append(method | level_bits)
+        out += lz4_header_struct.pack(len(compressed), len(block), xxh32(block, lz4_seed) & 0xFFFFFFF)
+        out += compressed
+    out += lz4_magic
+    out.append(0x10 | level_bits)
+    out += lz4_header_struct.pack(0, 0, 0)
+    return bytes(out)
+
+
+def xxh32(data, seed=0):
+    if xxhash is not None:
+        return xxhash.xxh32_intdigest(data, seed)
+    p1, p2, p3, p4, p5 = 2654435761, 2246822519, 3266489917, 668265263, 374761393
+    mask = 0xFFFFFFFF
+    rotl = lambda v, r: ((v << r) | (v >> (32 - r))) & mask
+    length = len(data)
+    pos = length - length % 16
+    if length >= 16:
+        v = [(seed + p1 + p2) & mask, (seed + p2) & mask, seed & mask, (seed - p1) & mask]
+        words = Struct(f"<{pos // 4}I").unpack_from(data, 0)
+        for i in range(0, len(words)):
+            v[i & 3] = rotl((v[i & 3] + words[i] * p2) & mask, 13) * p1 & mask
+        h = (rotl(v[0], 1) + rotl(v[1], 7) + rotl(v[2], 12) + rotl(v[3], 18)) & mask
+    else:
+        h = (seed + p5) & mask
+    h = (h + length) & mask
+    while pos + 4 <= length:
+        h = rotl((h + lz4_word_struct.unpack_from(data, pos)[0] * p3) & mask, 17) * p4 & mask
+        pos += 4
+    while pos < length:
+        h = rotl((h + data[pos] * p5) & mask, 11) * p1 & mask
+        pos += 1
+    h = ((h ^ (h >> 15)) * p2) & mask
+    h = ((h ^ (h >> 13)) * p3) & mask
+    return h ^ (h >> 16)
+
+
+def region_coords(file_name):
+    """Region coordinates (X, Z) from an "r.X.Z.mca" / "r.X.Z.mcr" file name, or None."""
+    match = region_name.match(os.path.basename(file_name))
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def diff(file_a, file_b, quick=False):
+    """Chunks that differ between two region files (a missing file counts as empty), as a list of
+    (x, z, kind, changes): kind is nbt_lib.ADDED, REMOVED or CHANGED, changes the nbt_lib.diff
+    of the two chunks for CHANGED ones.
+
+    Header entries are compared first, then the compressed payloads; only chunks whose payloads
+    differ are decompressed and decoded, lazily. Chunks that decode to the same tags (e.g. only
+    compressed differently) are not reported. quick=True takes chunks with the same timestamp
+    and sector count for unchanged, without comparing their payloads.
+    """
+    a = RegionFile(file_a, read_only=True) if os.path.exists(file_a) else None
+    b = RegionFile(file_b, read_only=True) if os.path.exists(file_b) else None
+    empty = array('I', bytes(sector_bytes))
+    changes = []
+    try:
+        a_offsets = empty if a is None else a.offsets
+        b_offsets = empty if b is None else b.offsets
+        for i in range(0, sector_ints):
+            x = i % 32
+            z = i // 32
+            if a_offsets[i] == 0 and b_offsets[i] == 0:
+                continue
+            if a_offsets[i] == 0:
+                changes.append((x, z, nbt_lib.ADDED, None))
+                continue
+            if b_offsets[i] == 0:
+                changes.append((x, z, nbt_lib.REMOVED, None))
+                continue
+            if quick and a.chunkTimestamps[i] == b.chunkTimestamps[i] and a_offsets[i] & 0xFF == b_offsets[i] & 0xFF:
+                continue
+            raw_a = a.read_chunk_raw(x, z)
+            raw_b = b.read_chunk_raw(x, z)
+            if raw_a is not None and raw_b is not None and raw_a[:2] == raw_b[:2]:
+                continue
+            data_a = a.read_chunk(x, z)
+            data_b = b.read_chunk(x, z)
+            if data_a is None or data_b is None:
+                if data_a is not None or data_b is not None:
+                    changes.append((x, z, nbt_lib.CHANGED, None))
+                continue
+            tag_changes = nbt_lib.diff(nbt_lib.read(data_a, lazy=True), nbt_lib.read(data_b, lazy=True))
+            if tag_changes:
+                changes.append((x, z, nbt_lib.CHANGED, tag_changes))
+    finally:
+        if a is not None:
+            a.close()
+        if b is not None:
+            b.close()
+    return changes
+
+
+def external_files(file_name):
+    """Paths of the external chunk files ("c.x.z.mcc") of a region file, next to it."""
+    region = region_coords(file_name)
+    if region is None:
+        return []
+    directory = os.path.dirname(file_name)
+    files = []
+    for f in os.listdir(directory or "."):
+        match = external_name.match(f)
+        if match is not None and (int(match.group(1)) >> 5, int(match.group(2)) >> 5) == region:
+            files.append(os.path.join(directory, f))
+    return files
+
+
+def compact(file_name):
+    """Rewrite a region file with all of its chunks stored back to back in header order
+    (x first, then z), dropping unused and orphaned sectors and truncating the file.
+    Chunk payloads are copied as they are, without decompressing them.
+    Returns the number of bytes saved."""
+    source = RegionFile(file_name, read_only=True)
+    temp_name = file_name + ".compact"
+    try:
+        offsets = array('I', bytes(sector_bytes))
+        with open(temp_name, "wb") as out:
+            out.write(bytes(sector_bytes * 2))
+            sector_num = 2
+            for i in range(0, sector_ints):
+                offset = source.offsets[i]
+                start = (offset >> 8) * sector_bytes
+                if offset == 0 or (offset >> 8) + (offset & 0xFF) > source.sectors.size:
+                    continue
+                length = length_struct.unpack_from(source.map, start)[0]
+                if length <= 0 or length > sector_bytes * (offset & 0xFF):
+                    dbg(source, f"COMPACT {i % 32, i // 32} invalid length: {length}")
+                    continue
+                num_sectors = (length + 4 + sector_bytes - 1) // sector_bytes
+                out.write(source.map[start:start + 4 + length])
+                out.write(bytes(num_sectors * sector_bytes - length - 4))
+                offsets[i] = (sector_num << 8) | num_sectors
+                sector_num += num_sectors
+            out.seek(0)
+            out.write(array_to_bytes('I', offsets) + array_to_bytes('I', source.chunkTimestamps))
+    finally:
+        source.close()
+    saved = os.path.getsize(file_name) - os.path.getsize(temp_name)
+    os.replace(temp_name, file_name)
+    return saved
@@ -2,8 +2,10 @@
 __author__ = "Karol"
 
 import region_file
+import manifest
 import os
 import nbt_lib as nbt
+from concurrent.futures import ProcessPoolExecutor
 
 # ---- INPUT DATA ----
 # Chunks to keep - our map
@@ -13,6 +15,12 @@ x_end = -12
 z_start = 9
 z_end = 30
 save_dir = "C:\\Users\\Karol\\AppData\\Roaming\\.minecraft\\saves\\Sky Islands v1.2\\region"
+# Number of worker processes, None - one per CPU
+workers = None
+# Delete chunks outside of the map instead of filling them with air
+delete_chunks = False
+# Skip regions and chunks unchanged since the last run (manifest file in save_dir)
+incremental = False
 
 
 # ---- END - INPUT DATA ----
@@ -21,48 +29,153 @@ def limit(xc, zc):
     return x_start <= xc <= x_end and z_start <= zc <= z_end
 
 
+def region_limit(rx, rz):
+    # Czy region (32x32 chunki) ma część wspólną z mapą
+    return rx * 32 <= x_end and x_start <= rx * 32 + 31 and rz * 32 <= z_end and z_start <= rz * 32 + 31
+
+
+# Returned by chunk_fn to drop the chunk
+DELETE = "delete"
+
+
+# Stałe tagi pustego chunka - zakodowane raz, wstawiane do każdego chunka
+emptyHeightMap = nbt.freeze(nbt.IntArray("HeightMap", [0] * 256))
+noLight = nbt.freeze(nbt.Byte("LightPopulated", 0))
+noInhabitedTime = nbt.freeze(nbt.Long("InhabitedTime", 0))
+noLastUpdate = nbt.freeze(nbt.Long("LastUpdate", 0))
+
+
 # Fill remaining chunks with air - in Anvil format - remove vertical sections
-delta = 1
-path = None
-while os.path.exists(path := os.path.join(save_dir, f"###Python_Optimizer_Backup{'#' * delta}")):
-    delta += 1
-delta = 0
-os.mkdir(path)
-emptyHeightMap = [0] * 256
-for r, d, files in os.walk(save_dir):
-    if "###Python_Optimizer_Backup" in r:
-        continue
-    print(r)
-    for f in files:
-        src = os.path.join(r, f)
-        dest = os.path.join(r, path, f)
+def optimize_chunk(xc, zc, load):
+    if limit(xc, zc):
+        # Chunk zostaje bez zmian - kopiuj skompresowane dane
+        return None
+    if delete_chunks:
+        return DELETE
+    tag = load().get("Level")
+    tag.get("Sections").clear()
+    tag.get("Entities").clear()
+    tag.get("TileEntities").clear()
+    if tag.contains("TileTicks"):
+        tag.get("TileTicks").clear()
+    tag.put(emptyHeightMap)
+    tag.put(noLight)
+    tag.remove("V")
+    tag.put(noInhabitedTime)
+    tag.put(noLastUpdate)
+    return nbt.root("").put(tag)
+
+
+def process_region(src, dest, chunk_fn, known=None):
+    """Move region file src, with its external chunk files, to the backup path dest and rebuild
+    src from it, chunk by chunk.
+
+    chunk_fn(xc, zc, load) gets global chunk coordinates and a function returning the decoded
+    (lazy) root tag; it returns the root tag to write, None to copy the chunk unchanged
+    or DELETE to leave it out. A region left with no chunks is removed.
+    known - {chunk index: (timestamp, payload hash)} from a manifest; chunks that still
+    match it are copied unchanged without calling chunk_fn.
+    Returns the number of bytes saved.
+    """
+    # Chunki zapisane poza regionem (c.x.z.mcc) przenoszone razem z nim
+    backup_dir = os.path.dirname(dest)
+    external = [os.path.join(backup_dir, os.path.basename(f)) for f in region_file.external_files(src)]
+    for f in external:
+        os.rename(os.path.join(os.path.dirname(src), os.path.basename(f)), f)
+    os.rename(src, dest)
+    before = os.path.getsize(dest) + sum(os.path.getsize(f) for f in external)
+    rx, rz = region_file.region_coords(src)
+    source = region_file.RegionFile(dest, read_only=True)
+    target = region_file.RegionFile(src)
+    for c in range(0, 1024):
+        x = c % 32
+        z = c // 32
+        if source.has_chunk(x, z):
+            try:
+                if known is not None and c in known:
+                    raw = source.read_chunk_raw(x, z)
+                    if raw is not None and (raw[2], manifest.payload_hash(raw[1])) == known[c]:
+                        target.write_chunk_raw(x, z, *raw)
+                        continue
+                root = chunk_fn(rx * 32 + x, rz * 32 + z, lambda: nbt.read(source.read_chunk(x, z), lazy=True))
+                if root is DELETE:
+                    continue
+                if root is None:
+                    raw = source.read_chunk_raw(x, z)
+                    if raw is not None:
+                        target.write_chunk_raw(x, z, *raw)
+                else:
+                    nbt.write(root, target.write_chunk(x, z))
+            except BaseException as e:
+                print(e)
+    empty = not any(target.offsets)
+    target.close()
+    source.close()
+    if empty:
+        os.remove(src)
+        return before
+    return before - os.path.getsize(src) - sum(os.path.getsize(f) for f in region_file.external_files(src))
+
+
+def process_world(save_dir, chunk_fn, workers=None, region_fn=None, incremental=False):
+    """Run process_region over every region file of save_dir, one region per worker process
+    (workers=1 - in this process). Originals are kept in a new backup directory.
+    If region_fn(rx, rz) is given and returns False, the region is only moved to the backup,
+    without being opened. chunk_fn must be picklable, i.e. a module-level function.
+    incremental=True - skip region files not modified since the last incremental run and chunks
+    whose timestamp and payload did not change, using the world's manifest (see manifest.py).
+    Returns the number of bytes saved."""
+    delta = 1
+    while os.path.exists(path := os.path.join(save_dir, f"###Python_Optimizer_Backup{'#' * delta}")):
+        delta += 1
+    state = manifest.Manifest.load(save_dir) if incremental else None
+    moves = []
+    jobs = []
+    for r, d, files in os.walk(save_dir):
+        if "###Python_Optimizer_Backup" in r:
+            continue
+        print(r)
+        for f in files:
+            region = region_file.region_coords(f)
+            if region is None:
+                continue
+            src = os.path.join(r, f)
+            name = os.path.relpath(src, save_dir)
+            if state is not None and state.unchanged(name, src):
+                continue
+            if region_fn is not None and not region_fn(*region):
+                for external in [src] + region_file.external_files(src):
+                    moves.append((external, os.path.join(r, path, os.path.basename(external))))
+                continue
+            jobs.append((src, os.path.join(r, path, f), None if state is None else state.chunks(name)))
+    if not moves and not jobs:
+        return 0
+    os.mkdir(path)
+    saved = 0
+    for src, dest in moves:
         os.rename(src, dest)
-        source = region_file.RegionFile(dest)
-        target = region_file.RegionFile(src)
-        for c in range(0, 1024):
-            x = c % 32
-            z = c // 32
-            if source.has_chunk(x, z):
-                try:
-                    tag = nbt.read(source.read_chunk(x, z)).get("Level")
-                    xw = tag.get("xPos")
-                    zw = tag.get("zPos")
-                    if not limit(xw, zw):
-                        tag.get("Sections").clear()
-                        tag.get("Entities").clear()
-                        tag.get("TileEntities").clear()
-                        if tag.contains("TileTicks"):
-                            tag.get("TileTicks").clear()
-                        tag.put(nbt.IntArray("HeightMap", emptyHeightMap))
-                        tag.put(nbt.Byte("LightPopulated", 0))
-                        tag.remove("V")
-                        tag.put(nbt.Long("InhabitedTime", 0))
-                        tag.put(nbt.Long("LastUpdate", 0))
-                    nbt.write(nbt.root("").put(tag), target.write_chunk(x, z))
-                except BaseException as e:
-                    print(e)
-        target.close()
-        source.close()
-        delta += os.path.getsize(dest) - os.path.getsize(src)
-        del source, target
-print(f"Zaoszczędzono: {delta / 1048576} MB")
+        saved += os.path.getsize(dest)
+    if workers == 1:
+        saved += sum(process_region(src, dest, chunk_fn, known) for src, dest, known in jobs)
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(process_region, src, dest, chunk_fn, known) for src, dest, known in jobs]
+            saved += sum(future.result() for future in futures)
+    if state is not None:
+        # Stan po przetworzeniu - punkt odniesienia dla następnego uruchomienia
+        for src, dest in moves:
+            state.forget(os.path.relpath(src, save_dir))
+        for src, dest, known in jobs:
+            name = os.path.relpath(src, save_dir)
+            if os.path.exists(src):
+                state.record(name, src)
+            else:
+                state.forget(name)
+        state.save()
+    return saved
+
+
+if __name__ == "__main__":
+    delta = process_world(save_dir, optimize_chunk, workers, region_limit if delete_chunks else None,
+                          incremental)
+    print(f"Zaoszczędzono: {delta / 1048576} MB")
@@ -0,0 +1,113 @@
+import random
+import unittest
+import unittest.mock
+import chunk_section
+import nbt_lib as nbt
+
+
+def _signed(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _reference_pack(indices, bits, padded):
+    """One index at a time: the spanning layout as one bit stream, the padded one by whole longs."""
+    per_long = 64 // bits
+    length = chunk_section.packed_length(bits, len(indices), padded)
+    longs = [0] * length
+    for i, value in enumerate(indices):
+        bit = (i // per_long * 64 + i % per_long * bits) if padded else i * bits
+        longs[bit // 64] |= value << bit % 64
+        if bit % 64 + bits > 64:
+            longs[bit // 64 + 1] |= value >> (64 - bit % 64)
+    return [_signed(v & (1 << 64) - 1) for v in longs]
+
+
+def _section(palette_size, data_version):
+    palette = nbt.List(None)
+    for i in range(0, palette_size):
+        palette.put(nbt.Compound(None).put(nbt.String("Name", f"minecraft:block_{i}")))
+    if data_version >= 2860:
+        # 1.18+: paleta i dane w compoundzie block_states
+        palette.name = "palette"
+        return nbt.Compound(None).put(nbt.Compound("block_states").put(palette)), palette
+    palette.name = "Palette"
+    return nbt.Compound(None).put(palette), palette
+
+
+def _names(palette):
+    return [entry.get("Name") for entry in palette.data]
+
+
+class PackedIndices(unittest.TestCase):
+
+    def check_codec(self):
+        rnd = random.Random(5)
+        for bits in range(1, 17):
+            for count in (chunk_section.section_blocks, 100):
+                indices = [rnd.randrange(1 << bits) for x in range(0, count)]
+                for padded in (True, False):
+                    packed = chunk_section.pack(indices, bits, padded)
+                    self.assertEqual(list(packed), _reference_pack(indices, bits, padded), f"{bits} bits, {padded}")
+                    unpacked = chunk_section.unpack(_reference_pack(indices, bits, padded), bits, count, padded)
+                    self.assertEqual(list(unpacked), indices, f"{bits} bits, {padded}")
+
+    def test_numpy(self):
+        if chunk_section.numpy is None:
+            self.skipTest("needs numpy")
+        self.check_codec()
+
+    def test_without_numpy(self):
+        with unittest.mock.patch.object(chunk_section, "numpy", None):
+            self.check_codec()
+
+
+class SectionBlocks(unittest.TestCase):
+
+    def check_sections(self):
+        rnd = random.Random(6)
+        # Sekcja 1.13 - 1.15: 20 wpisów palety, 5 bitów w ciągłym strumieniu
+        section, palette = _section(20, 1631)
+        indices = [rnd.randrange(20) for x in range(0, chunk_section.section_blocks)]
+        section.put(nbt.LongArray("BlockStates", _reference_pack(indices, 5, False)))
+        read, read_palette = chunk_section.read_blocks(section)
+        self.assertEqual(list(read), indices)
+        self.assertIs(read_palette, palette)
+        chunk_section.write_blocks(section, read, read_palette)
+        self.assertEqual(len(section.get("BlockStates")), chunk_section.packed_length(5, padded=False))
+        self.assertEqual(list(chunk_section.read_blocks(section)[0]), indices)
+
+        # Nieużywane wpisy palety są usuwane, liczba bitów liczona od nowa
+        used = [3, 7, 19]
+        sparse = [rnd.choice(used) for x in range(0, chunk_section.section_blocks)]
+        chunk_section.write_blocks(section, sparse, palette)
+        read, read_palette = chunk_section.read_blocks(section)
+        self.assertEqual(_names(read_palette), [f"minecraft:block_{u}" for u in used])
+        self.assertEqual([used[i] for i in read], sparse)
+        self.assertEqual(len(section.get("BlockStates")), chunk_section.packed_length(4, padded=False))
+
+        # 1.18+: jeden wpis palety - bez tablicy danych
+        section, palette = _section(8, 2975)
+        chunk_section.write_blocks(section, [2] * chunk_section.section_blocks, palette)
+        states = section.get("block_states")
+        self.assertFalse(states.contains("data"))
+        self.assertEqual(_names(states.get_tag("palette")), ["minecraft:block_2"])
+        read, read_palette = chunk_section.read_blocks(section)
+        self.assertEqual(list(read), [0] * chunk_section.section_blocks)
+
+        section, palette = _section(40, 2975)
+        indices = [rnd.randrange(40) for x in range(0, chunk_section.section_blocks)]
+        chunk_section.write_blocks(section, indices, palette)
+        self.assertEqual(list(section.get("block_states").get("data")), _reference_pack(indices, 6, True))
+
+    def test_numpy(self):
+        if chunk_section.numpy is None:
+            self.skipTest("needs numpy")
+        self.check_sections()
+
+    def test_without_numpy(self):
+        with unittest.mock.patch.object(chunk_section, "numpy", None):
+            self.check_sections()
+
+
+if __name__ == "__main__":
+    unittest.main()
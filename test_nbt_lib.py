@@ -0,0 +1,219 @@
+import copy
+import pickle
+import unittest
+import unittest.mock
+import java_data_io as dio
+import nbt_lib as nbt
+
+strings = ["", "ascii", "zażółć gęślą jaźń", "a\0b", "\0", "emoji \U0001F600 and \0 NUL", "\U00010000￿߿\x7f"]
+
+
+def _string_root(value):
+    return nbt.root("").put(nbt.String("s", value)).put(nbt.String(value, "name"))
+
+
+class StringRoundTrip(unittest.TestCase):
+
+    def test_write_bytes(self):
+        for value in strings:
+            data = nbt.write_bytes(_string_root(value))
+            root = nbt.read_bytes(bytes(data))
+            self.assertEqual(root.get("s"), value)
+            self.assertEqual(root.get(value), "name")
+
+    def test_data_io(self):
+        for value in strings:
+            stream = dio.ByteArrayIO()
+            nbt._write_named_tag(_string_root(value), dio.DataIO(stream))
+            self.assertEqual(bytes(stream.bytearr), bytes(nbt.write_bytes(_string_root(value))))
+            stream.seek(0)
+            self.assertEqual(nbt.read(dio.DataIO(stream)).get("s"), value)
+
+    def test_modified_utf8(self):
+        self.assertEqual(dio.encode_utf("a\0b"), b"a\xc0\x80b")
+        self.assertEqual(dio.encode_utf("\U0001F600"), b"\xed\xa0\xbd\xed\xb8\x80")
+        for value in strings:
+            self.assertEqual(dio.decode_utf(dio.encode_utf(value)), value)
+
+
+class ByteArrayViews(unittest.TestCase):
+
+    def setUp(self):
+        section = nbt.Compound("Section").put(nbt.ByteArray("Blocks", bytearray(range(256)) * 16))
+        self.data = bytes(nbt.write_bytes(nbt.root("").put(section)))
+
+    def read(self, lazy):
+        return nbt.read(dio.DataIO(dio.BufferIO(self.data)), lazy=lazy)
+
+    def roots(self, lazy):
+        yield self.read(lazy)
+        yield nbt.read(dio.DataIO(dio.ByteArrayIO(bytearray(self.data))), lazy=lazy)
+        yield nbt.read_bytes(bytearray(self.data), lazy=lazy)
+        yield nbt.read_bytes(self.data, lazy=lazy)
+
+    def test_change_in_place(self):
+        for lazy in (False, True):
+            for root in self.roots(lazy):
+                root.get("Section").get("Blocks")[5] = 200
+                self.assertEqual(root.get("Section").get("Blocks")[5], 200)
+                self.assertEqual(nbt.read_bytes(nbt.write_bytes(root)).get("Section").get("Blocks")[5], 200)
+
+    def test_copy_and_pickle(self):
+        for lazy in (False, True):
+            for root in self.roots(lazy):
+                for copied in (copy.deepcopy(root), pickle.loads(pickle.dumps(root))):
+                    self.assertEqual(bytes(nbt.write_bytes(copied)), self.data)
+
+
+class PrimitiveLists(unittest.TestCase):
+
+    def setUp(self):
+        pos = nbt.List("Pos")
+        for value in (1.5, 64.0, -3.25):
+            pos.put(nbt.Double(None, value))
+        self.data = bytes(nbt.write_bytes(nbt.root("").put(pos)))
+
+    def test_change_element(self):
+        for lazy in (False, True):
+            root = nbt.read(dio.DataIO(dio.BufferIO(self.data)), lazy=lazy)
+            pos = root.get_tag("Pos")
+            pos.get(0).data = 42.0
+            pos.data[2].data = 7.0
+            self.assertIs(pos.get(1), pos.data[1])
+            self.assertEqual([tag.data for tag in pos.data], [42.0, 64.0, 7.0])
+            written = nbt.read_bytes(nbt.write_bytes(root)).get_tag("Pos")
+            self.assertEqual([tag.data for tag in written.data], [42.0, 64.0, 7.0])
+
+    def test_unchanged(self):
+        for lazy in (False, True):
+            root = nbt.read_bytes(self.data, lazy=lazy)
+            self.assertEqual(len(root.get_tag("Pos").data), 3)
+            self.assertEqual(bytes(nbt.write_bytes(root)), self.data)
+            self.assertEqual(root.get_tag("Pos").payload_size(), 5 + 3 * 8)
+            stream = dio.ByteArrayIO()
+            nbt._write_named_tag(root, dio.DataIO(stream))
+            self.assertEqual(bytes(stream.bytearr), self.data)
+            self.assertIsNone(root.get_tag("Pos").data.tags)
+        root = nbt.read_bytes(self.data)
+        with self.assertRaises(AttributeError):
+            root.get_tag("Pos").put(nbt.Int(None, 1))
+
+
+class WriterRoot(unittest.TestCase):
+
+    def test_unnamed_root(self):
+        out = bytearray()
+        writer = nbt.Writer(out)
+        with writer.begin_compound():
+            writer.write_value(3, 5, "x")
+        self.assertEqual(bytes(out), bytes(nbt.write_bytes(nbt.root("").put(nbt.Int("x", 5)))))
+
+    def test_context_manager(self):
+        expected = bytes(nbt.write_bytes(nbt.root("").put(nbt.Compound("Level").put(nbt.Int("x", 5)))))
+        out = bytearray()
+        with nbt.Writer(out) as writer:
+            writer.begin_compound()
+            with writer.begin_compound("Level"):
+                writer.write_value(3, 5, "x")
+            writer.end()
+        self.assertEqual(bytes(out), expected)
+        out = bytearray()
+        writer = nbt.Writer(out)
+        with writer.begin_compound():
+            with writer.begin_compound("Level"):
+                writer.write_value(3, 5, "x")
+                writer.end()
+        self.assertEqual(bytes(out), expected)
+
+    def test_unnamed_child(self):
+        writer = nbt.Writer(bytearray())
+        writer.begin_compound("")
+        with self.assertRaises(IOError):
+            writer.write_value(3, 5)
+
+
+class FrozenTags(unittest.TestCase):
+
+    def test_pickle(self):
+        level = nbt.Compound("Level").put(nbt.IntArray("HeightMap", [3] * 256)).put(nbt.Long("InhabitedTime", 0))
+        level.put(nbt.ByteArray("Biomes", bytearray(256))).put(nbt.String("Status", "full"))
+        pos = nbt.List("Pos")
+        pos.put(nbt.Double(None, 1.5))
+        level.put(pos)
+        frozen = nbt.freeze(level)
+        copied = pickle.loads(pickle.dumps(frozen))
+        self.assertIsInstance(copied, nbt.FrozenCompound)
+        self.assertIsInstance(copied.get_tag("Pos"), nbt.FrozenList)
+        self.assertEqual(copied.payload, frozen.payload)
+        self.assertEqual(bytes(nbt.write_bytes(nbt.root("").put(copied))), bytes(nbt.write_bytes(nbt.root("").put(level))))
+        self.assertIs(copy.deepcopy(frozen), frozen)
+        with self.assertRaises(AttributeError):
+            copied.put(nbt.Int("x", 1))
+
+
+class LazyRemove(unittest.TestCase):
+
+    def test_remove_without_decoding(self):
+        root = nbt.root("").put(nbt.Compound("Level").put(nbt.Int("x", 1))).put(nbt.IntArray("Big", [1] * 64))
+        data = bytes(nbt.write_bytes(root))
+        lazy = nbt.read_bytes(data, lazy=True)
+        with unittest.mock.patch.object(nbt._LazyDict, "_decode", side_effect=AssertionError("decoded")):
+            lazy.remove("Big")
+        self.assertFalse(lazy.contains("Big"))
+        root.remove("Big")
+        self.assertEqual(bytes(nbt.write_bytes(lazy)), bytes(nbt.write_bytes(root)))
+
+
+def _chunk(x_pos, entity_y, status):
+    level = nbt.Compound("Level").put(nbt.Int("xPos", x_pos)).put(nbt.String("Status", status))
+    entities = nbt.List("Entities")
+    for y in (entity_y, 70.0):
+        pos = nbt.List("Pos")
+        for value in (1.5, y, -3.0):
+            pos.put(nbt.Double(None, value))
+        entities.put(nbt.Compound(None).put(pos).put(nbt.List("Passengers")))
+    level.put(entities).put(nbt.IntArray("HeightMap", [4] * 256)).put(nbt.List("TileTicks"))
+    return nbt.root("").put(level)
+
+
+class TreeDiff(unittest.TestCase):
+
+    def forms(self, root):
+        data = bytes(nbt.write_bytes(root))
+        return [nbt.read_bytes(data), nbt.read_bytes(data, lazy=True), nbt.freeze(nbt.read_bytes(data))]
+
+    def test_representations(self):
+        for a in self.forms(_chunk(3, 64.0, "full")):
+            for b in self.forms(_chunk(3, 65.0, "full")):
+                self.assertEqual([(kind, path) for kind, path, old, new in nbt.diff(a, b)],
+                                 [(nbt.CHANGED, "Level.Entities.0.Pos.1")])
+            for b in self.forms(_chunk(3, 64.0, "full")):
+                self.assertEqual(nbt.diff(a, b), [])
+
+    def test_empty_list_and_order(self):
+        out = bytearray()
+        writer = nbt.Writer(out)
+        with writer.begin_compound():
+            writer.begin_list(10, 0, "TileTicks").end()
+            writer.write_value(3, 3, "xPos")
+        a = nbt.read_bytes(bytes(out), lazy=True)
+        b = nbt.root("").put(nbt.Int("xPos", 3)).put(nbt.List("TileTicks"))
+        self.assertEqual(nbt.diff(a, b), [])
+        self.assertEqual(nbt._digest(a, {}), nbt._digest(b, {}))
+
+
+class LazyDictAccess(unittest.TestCase):
+
+    def test_no_raw_values(self):
+        data = bytes(nbt.write_bytes(nbt.root("").put(nbt.Int("x", 1)).put(nbt.String("s", "a"))))
+        children = nbt.read_bytes(data, lazy=True).data
+        merged = {}
+        merged.update(children)
+        for copied in (dict(children), {**children}, children | {}, {} | children, merged):
+            self.assertEqual({name: tag.data for name, tag in copied.items()}, {"x": 1, "s": "a"})
+        self.assertTrue(children == dict(children))
+        self.assertFalse(children != dict(children))
+
+
+if __name__ == "__main__":
+    unittest.main()
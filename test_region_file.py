@@ -0,0 +1,213 @@
+import os
+import random
+import tempfile
+import unittest
+import unittest.mock
+import zlib
+import nbt_lib as nbt
+import region_file
+from region_file import SectorAllocator, max_chunk_size
+
+
+def _scan(sector_free, count):
+    """First run of count free sectors found by a scan over every sector, as RegionFile did before SectorAllocator."""
+    run_start = -1
+    run_length = 0
+    for i, free in enumerate(sector_free):
+        if not free:
+            run_length = 0
+            continue
+        if run_length == 0:
+            run_start = i
+        run_length += 1
+        if run_length >= count:
+            return run_start
+    return None
+
+
+def _runs(sector_free):
+    runs = []
+    for i, free in enumerate(sector_free):
+        if free and (i == 0 or not sector_free[i - 1]):
+            runs.append([i, 0])
+        if free:
+            runs[-1][1] += 1
+    return runs
+
+
+class SectorAllocatorRandom(unittest.TestCase):
+
+    def run_random(self, seed, best_fit):
+        rnd = random.Random(seed)
+        sector_free = [False, False] + [rnd.random() < 0.3 for x in range(0, 400)]
+        allocator = SectorAllocator.from_free_map(sector_free, best_fit)
+        used = []
+        for step in range(0, 1000):
+            if used and rnd.random() < 0.45:
+                start, count = used.pop(rnd.randrange(len(used)))
+                allocator.free(start, count)
+                sector_free[start:start + count] = [True] * count
+            else:
+                count = rnd.choice((1, 1, 2, 3, 5, rnd.randrange(1, max_chunk_size)))
+                start = allocator.allocate(count)
+                if best_fit:
+                    fitting = [run for run in _runs(sector_free) if run[1] >= count]
+                    expected = min(fitting, key=lambda run: (min(run[1], max_chunk_size), run[0]))[0] if fitting else None
+                else:
+                    expected = _scan(sector_free, count)
+                self.assertEqual(start, expected, f"seed {seed}, step {step}, {count} sectors")
+                if start is None:
+                    start = allocator.extend(count)
+                    sector_free += [False] * count
+                else:
+                    self.assertTrue(all(sector_free[start:start + count]))
+                    sector_free[start:start + count] = [False] * count
+                used.append((start, count))
+            self.assertEqual(allocator.size, len(sector_free))
+            self.assertEqual(allocator.free_sectors(), sum(sector_free))
+        self.assertEqual([allocator.is_free(i) for i in range(0, len(sector_free))], sector_free)
+
+    def test_first_fit(self):
+        for seed in range(0, 10):
+            self.run_random(seed, False)
+
+    def test_best_fit(self):
+        for seed in range(0, 10):
+            self.run_random(seed, True)
+
+    def test_free_merges_runs(self):
+        allocator = SectorAllocator.from_free_map([False] * 10)
+        allocator.free(3, 2)
+        allocator.free(6, 2)
+        allocator.free(5, 1)
+        allocator.free(0, 2)
+        self.assertEqual(allocator.starts, [3])
+        self.assertEqual(allocator.lengths, {3: 5})
+        self.assertEqual(allocator.allocate(5), 3)
+        self.assertIsNone(allocator.allocate(1))
+
+
+class ReadOnlyClose(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "r.0.0.mca")
+        region = region_file.RegionFile(self.path)
+        region.write_chunks({(1, 2): nbt.root("").put(nbt.Int("x", 1))})
+        region.close()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_close_with_view(self):
+        region = region_file.RegionFile(self.path, read_only=True)
+        view = memoryview(region.map)[0:16]
+        region.close()
+        view.release()
+
+    def test_corrupt_chunk(self):
+        region = region_file.RegionFile(self.path, read_only=True)
+        offset = region.get_offset(1, 2)
+        region.close()
+        with open(self.path, "r+b") as f:
+            f.seek((offset >> 8) * region_file.sector_bytes + 5)
+            f.write(b"\xff" * 4)
+        region = region_file.RegionFile(self.path, read_only=True)
+        try:
+            with self.assertRaises(zlib.error):
+                region.read_chunk(1, 2)
+        finally:
+            region.close()
+
+
+def _big_root(size, seed):
+    # Losowe bajty się nie kompresują - chunk większy niż max_chunk_size sektorów
+    data = bytearray(random.Random(seed).randbytes(size))
+    return nbt.root("").put(nbt.ByteArray("Data", data))
+
+
+class Compression(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "r.1.-1.mca")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_versions(self):
+        versions = [region_file.version_gzip, region_file.version_zlib, region_file.version_none]
+        if region_file.lz4 is not None:
+            versions.append(region_file.version_lz4)
+        root = nbt.root("").put(nbt.IntArray("HeightMap", list(range(0, 256))))
+        for version in versions:
+            region = region_file.RegionFile(self.path, compression=version)
+            region.write_chunks({(3, 4): root})
+            region.close()
+            region = region_file.RegionFile(self.path, read_only=True)
+            self.assertEqual(region.read_chunk_raw(3, 4)[0], version)
+            self.assertEqual(region.read_chunk_versioned(3, 4)[0], version)
+            self.assertEqual(bytes(nbt.write_bytes(nbt.read(region.read_chunk(3, 4)))), bytes(nbt.write_bytes(root)))
+            region.close()
+
+    @unittest.skipIf(region_file.lz4 is None, "needs the lz4 module")
+    def test_lz4_blocks(self):
+        rnd = random.Random(1)
+        data = bytes(150000) + rnd.randbytes(70000)
+        raw = region_file.lz4_compress(data)
+        self.assertEqual(region_file.lz4_decompress(raw), data)
+        pos = 0
+        blocks = []
+        methods = []
+        while True:
+            self.assertEqual(raw[pos:pos + 8], region_file.lz4_magic)
+            compressed_length, length, checksum = region_file.lz4_header_struct.unpack_from(raw, pos + 9)
+            if length == 0:
+                break
+            block = data[len(b"".join(blocks)):][:length]
+            self.assertEqual(checksum, region_file.xxh32(block, region_file.lz4_seed) & 0xFFFFFFF)
+            blocks.append(block)
+            methods.append(raw[pos + 8] & 0xF0)
+            pos += 21 + compressed_length
+        self.assertEqual(pos + 21, len(raw))
+        self.assertEqual([len(block) for block in blocks], [65536, 65536, 65536, 23392])
+        # Ostatni blok to losowe bajty - zapisany bez kompresji
+        self.assertEqual(methods, [0x20, 0x20, 0x20, 0x10])
+
+    def test_xxh32_fallback(self):
+        rnd = random.Random(2)
+        samples = [rnd.randbytes(n) for n in (1, 3, 4, 15, 16, 17, 31, 64, 100)]
+        expected = [region_file.xxh32(data, region_file.lz4_seed) for data in samples]
+        compare = region_file.xxhash is not None
+        with unittest.mock.patch.object(region_file, "xxhash", None):
+            self.assertEqual(region_file.xxh32(b""), 0x02CC5D05)
+            self.assertEqual(region_file.xxh32(b"abc"), 0x32D153FF)
+            self.assertEqual(region_file.xxh32(b"Nobody inspects the spammish repetition"), 0xE2293B2F)
+            if compare:
+                self.assertEqual([region_file.xxh32(data, region_file.lz4_seed) for data in samples], expected)
+
+    def test_external_chunk(self):
+        external = os.path.join(self.dir.name, "c.35.-28.mcc")
+        big = _big_root(region_file.max_chunk_size * region_file.sector_bytes + 1000, 3)
+        region = region_file.RegionFile(self.path, compression=region_file.version_none)
+        region.write_chunks({(3, 4): big, (5, 6): big})
+        self.assertTrue(os.path.exists(external))
+        self.assertEqual(region.get_offset(3, 4) & 0xFF, 1)
+        region.close()
+        region = region_file.RegionFile(self.path, read_only=True)
+        self.assertEqual(region.read_chunk_raw(3, 4)[0], region_file.version_none)
+        self.assertEqual(nbt.read(region.read_chunk(3, 4)).get("Data"), big.get("Data"))
+        region.close()
+        self.assertEqual(sorted(region_file.external_files(self.path)),
+                         sorted([external, os.path.join(self.dir.name, "c.37.-26.mcc")]))
+        region = region_file.RegionFile(self.path)
+        region.write_chunks({(3, 4): nbt.root("").put(nbt.Int("x", 1))})
+        self.assertFalse(os.path.exists(external))
+        region.delete_chunk(5, 6)
+        self.assertEqual(region_file.external_files(self.path), [])
+        self.assertEqual(nbt.read(region.read_chunk(3, 4)).get("x"), 1)
+        region.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+"""
+World - chunks of a whole region directory addressed by global chunk coordinates.
+
+Chunk (xc, zc) lives in region file "r.{xc >> 5}.{zc >> 5}.mca" at local coordinates
+(xc & 31, zc & 31). Open region files are kept in a bounded pool, the least recently used
+one is closed when the pool is full. Decoded chunks are kept in a bounded LRU cache;
+chunks changed through put_chunk / mark_dirty are written back when they leave the
+cache, on flush() and on close(). Written chunks are compressed in one thread pool shared
+by all regions (sized by the workers option).
+"""
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import nbt_lib as nbt
+import region_file
+
+
+class World:
+
+    def __init__(self, save_dir, read_only=False, max_regions=64, max_chunks=1024, lazy=False,
+                 extension="mca", **region_options):
+        self.saveDir = save_dir
+        self.readOnly = read_only
+        self.maxRegions = max_regions
+        self.maxChunks = max_chunks
+        self.lazy = lazy
+        self.extension = extension
+        # Dodatkowe argumenty dla RegionFile (compression, workers, ...)
+        self.regionOptions = region_options
+        self.regions = OrderedDict()  # (rx, rz) -> RegionFile
+        self.chunks = OrderedDict()  # (xc, zc) -> root tag
+        self.dirty = set()
+        # Jedna pula wątków kompresji dla wszystkich regionów, tworzona przy pierwszym zapisie
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def locate(xc, zc):
+        """Region coordinates and local chunk coordinates of a global chunk: ((rx, rz), x, z)."""
+        return (xc >> 5, zc >> 5), xc & 31, zc & 31
+
+    def region_path(self, rx, rz):
+        return os.path.join(self.saveDir, f"r.{rx}.{rz}.{self.extension}")
+
+    def region_list(self):
+        """Coordinates of all region files of the world."""
+        suffix = "." + self.extension
+        return sorted(coords for f in os.listdir(self.saveDir)
+                      if f.endswith(suffix) and (coords := region_file.region_coords(f)) is not None)
+
+    def region(self, rx, rz, create=False):
+        """Open RegionFile of the region from the pool, None if it does not exist (and create is False)."""
+        key = (rx, rz)
+        region = self.regions.get(key)
+        if region is not None:
+            self.regions.move_to_end(key)
+            return region
+        path = self.region_path(rx, rz)
+        if not os.path.exists(path) and (self.readOnly or not create):
+            return None
+        while len(self.regions) >= self.maxRegions:
+            self.regions.popitem(last=False)[1].close()
+        region = region_file.RegionFile(path, read_only=self.readOnly, **self.regionOptions)
+        self.regions[key] = region
+        return region
+
+    def has_chunk(self, xc, zc):
+        if (xc, zc) in self.chunks:
+            return True
+        (rx, rz), x, z = self.locate(xc, zc)
+        region = self.region(rx, rz)
+        return region is not None and region.has_chunk(x, z)
+
+    def chunk_coords(self):
+        """Global coordinates of all chunks stored in the world's region files."""
+        for rx, rz in self.region_list():
+            region = self.region(rx, rz)
+            for c in range(0, 1024):
+                if region.offsets[c] != 0:
+                    yield rx * 32 + c % 32, rz * 32 + c // 32
+
+    def get_chunk(self, xc, zc):
+        """Decoded root tag of a chunk, None if it does not exist. Changes made to the returned
+        tag are only saved after mark_dirty(xc, zc)."""
+        key = (xc, zc)
+        root = self.chunks.get(key)
+        if root is not None:
+            self.chunks.move_to_end(key)
+            return root
+        (rx, rz), x, z = self.locate(xc, zc)
+        region = self.region(rx, rz)
+        if region is None:
+            return None
+        data = region.read_chunk(x, z)
+        if data is None:
+            return None
+        root = nbt.read(data, lazy=self.lazy)
+        self.__cache(key, root)
+        return root
+
+    def put_chunk(self, xc, zc, root):
+        """Replace a chunk with the given root tag; it is written to the region file later."""
+        if self.readOnly:
+            raise IOError("World opened read-only")
+        key = (xc, zc)
+        self.__cache(key, root)
+        self.dirty.add(key)
+
+    def mark_dirty(self, xc, zc):
+        if self.readOnly:
+            raise IOError("World opened read-only")
+        if (xc, zc) in self.chunks:
+            self.dirty.add((xc, zc))
+
+    def delete_chunk(self, xc, zc):
+        if self.readOnly:
+            raise IOError("World opened read-only")
+        self.chunks.pop((xc, zc), None)
+        self.dirty.discard((xc, zc))
+        (rx, rz), x, z = self.locate(xc, zc)
+        region = self.region(rx, rz)
+        if region is not None:
+            region.delete_chunk(x, z)
+
+    def __cache(self, key, root):
+        self.chunks[key] = root
+        self.chunks.move_to_end(key)
+        while len(self.chunks) > self.maxChunks:
+            old, old_root = self.chunks.popitem(last=False)
+            if old in self.dirty:
+                self.dirty.discard(old)
+                (rx, rz), x, z = self.locate(*old)
+                self.region(rx, rz, create=True).write_chunks({(x, z): old_root}, executor=self.__executor())
+
+    def __executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.regionOptions.get("workers"))
+        return self.executor
+
+    def flush(self):
+        """Write back all changed chunks, grouped by region, and flush the open region files."""
+        by_region = {}
+        for key in self.dirty:
+            (rx, rz), x, z = self.locate(*key)
+            by_region.setdefault((rx, rz), {})[(x, z)] = self.chunks[key]
+        self.dirty.clear()
+        for (rx, rz), chunks in sorted(by_region.items()):
+            self.region(rx, rz, create=True).write_chunks(chunks, executor=self.__executor())
+        for region in self.regions.values():
+            region.flush()
+
+    def close(self):
+        if not self.readOnly:
+            self.flush()
+        while self.regions:
+            self.regions.popitem()[1].close()
+        self.chunks.clear()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None